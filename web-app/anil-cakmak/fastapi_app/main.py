@@ -1,24 +1,101 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException
 from pydantic import BaseModel
-from my_agent.chat import chat
-from starlette.responses import StreamingResponse
+from my_agent.agent import checkpointer
+from my_agent.chat import chat_events, event_text, turn_checkpoint
+from my_agent.utils.checkpointer import run_compaction
+from my_agent.utils.idempotency import IDEMPOTENCY_CONFIG, idempotent_events, request_key
+from my_agent.utils.metrics import ACTIVE_STREAMS, CONTENT_TYPE, render_metrics
+from my_agent.utils.tools import search_client
+from my_agent.utils.usage import usage_store
+from starlette.requests import Request as HTTPRequest
+from starlette.responses import Response, StreamingResponse
+from typing import Any, AsyncGenerator, Dict, Optional
 
 class Request(BaseModel):
     user_input: str
     thread: str
+    stream_tokens: bool = True
+    budget_s: Optional[float] = None
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    compaction = asyncio.create_task(run_compaction(checkpointer))
+    yield
+    compaction.cancel()
+    await search_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def tracked(stream: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+    ACTIVE_STREAMS.inc()
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        ACTIVE_STREAMS.dec()
+
+
+async def agent_events(request: Request, http_request: HTTPRequest,
+                       idempotency_key: Optional[str]) -> AsyncGenerator[Dict[str, Any], None]:
+    # Resent requests (same Idempotency-Key, or same thread, turn and input)
+    # share one run instead of starting another.
+    checkpoint = None
+    if IDEMPOTENCY_CONFIG["enabled"] and not idempotency_key:
+        checkpoint = await turn_checkpoint(request.thread)
+    key, ttl_seconds = request_key(request.thread, request.user_input, idempotency_key, checkpoint)
+    async for item in idempotent_events(
+            key, ttl_seconds,
+            lambda is_disconnected: chat_events(request.user_input, request.thread, request.stream_tokens,
+                                                request.budget_s, is_disconnected),
+            http_request.is_disconnected):
+        yield item
+
+
+async def server_sent_events(events: AsyncGenerator[Dict[str, Any], None]) -> AsyncGenerator[str, None]:
+    event_id = 0
+    async for item in events:
+        event_id += 1
+        yield f"id: {event_id}\nevent: {item['event']}\ndata: {json.dumps(item['data'])}\n\n"
 
 
 @app.post("/agent")
-async def query_agent(request: Request):
+async def query_agent(request: Request, http_request: HTTPRequest,
+                      idempotency_key: Optional[str] = Header(None)):
     try:
-        return StreamingResponse(chat(request.user_input, request.thread), media_type="text/plain")
+        stream = event_text(agent_events(request, http_request, idempotency_key))
+        return StreamingResponse(tracked(stream), media_type="text/plain")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/agent/events")
+async def query_agent_events(request: Request, http_request: HTTPRequest,
+                             idempotency_key: Optional[str] = Header(None)):
+    try:
+        events = agent_events(request, http_request, idempotency_key)
+        return StreamingResponse(tracked(server_sent_events(events)), media_type="text/event-stream", headers=SSE_HEADERS)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/usage/{thread}")
+async def usage(thread: str):
+    return await asyncio.to_thread(usage_store.thread_usage, thread)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+
 @app.get("/")
 async def root():
     return {"message": "Agent API is running"}
\ No newline at end of file
@@ -1,7 +1,9 @@
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
 from my_agent.utils.state import AgentState
+from my_agent.utils.checkpointer import build_checkpointer
+from my_agent.utils.node_cache import NODE_CACHE_CONFIG, cached_node
 from my_agent.utils.nodes import (
+    conversation_summarizer_node,
     user_guide_node,
     determine_flow,
     itinerary_researcher_node,
@@ -12,17 +14,34 @@ from my_agent.utils.nodes import (
     itinerary_planner_node
 )
 
-memory = MemorySaver()
+checkpointer = build_checkpointer()
+
+# State keys read by the deterministic nodes; with NODE_CACHE=on their output
+# is reused while these inputs are unchanged.
+NODE_CACHE_READS = {
+    "destination_planner": ("task",),
+    "transport_advisor": ("basic_plan",),
+    "accommodation_advisor": ("basic_plan",),
+    "itinerary_planner": ("basic_plan", "search"),
+}
+
+
+def node(name, fn):
+    if NODE_CACHE_CONFIG["enabled"] and name in NODE_CACHE_READS:
+        return cached_node(name, fn, NODE_CACHE_READS[name])
+    return fn
+
 
 workflow = StateGraph(AgentState)
 
+workflow.add_node("conversation_summarizer", conversation_summarizer_node)
 workflow.add_node("user_guide", user_guide_node)
 workflow.add_node("itinerary_researcher", itinerary_researcher_node)
 workflow.add_node("itinerary_optimizer", itinerary_optimizer_node)
-workflow.add_node("destination_planner", destination_planner_node)
-workflow.add_node("transport_advisor", transport_advisor_node)
-workflow.add_node("accommodation_advisor", accommodation_advisor_node)
-workflow.add_node("itinerary_planner", itinerary_planner_node)
+workflow.add_node("destination_planner", node("destination_planner", destination_planner_node))
+workflow.add_node("transport_advisor", node("transport_advisor", transport_advisor_node))
+workflow.add_node("accommodation_advisor", node("accommodation_advisor", accommodation_advisor_node))
+workflow.add_node("itinerary_planner", node("itinerary_planner", itinerary_planner_node))
 
 workflow.add_conditional_edges(
             "user_guide",
@@ -30,6 +49,7 @@ workflow.add_conditional_edges(
             {"plan": "destination_planner", "refine": "itinerary_researcher", "assistant": END}
         )
 
+workflow.add_edge("conversation_summarizer", "user_guide")
 workflow.add_edge("itinerary_researcher", "itinerary_optimizer")
 workflow.add_edge("itinerary_optimizer", END)
 workflow.add_edge("destination_planner", "transport_advisor")
@@ -38,6 +58,6 @@ workflow.add_edge("transport_advisor", "itinerary_planner")
 workflow.add_edge("accommodation_advisor", "itinerary_planner")
 workflow.add_edge("itinerary_planner", END)
 
-workflow.set_entry_point("user_guide")
+workflow.set_entry_point("conversation_summarizer")
 
-graph = workflow.compile(checkpointer=memory)
\ No newline at end of file
+graph = workflow.compile(checkpointer=checkpointer)
\ No newline at end of file
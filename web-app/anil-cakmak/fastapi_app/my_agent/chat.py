@@ -1,23 +1,233 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
 from my_agent.agent import graph
-from typing import Generator
+from my_agent.utils.budget import with_deadline
+from my_agent.utils.locks import thread_lock
+from my_agent.utils.nodes import ROUTING_PREFIXES
+from my_agent.utils.metrics import CANCELLATIONS, NODE_DURATION, MetricsCallbackHandler
+from my_agent.utils.usage import UsageCallbackHandler
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langgraph.constants import END
 
-def chat(user_input: str, thread: str) -> Generator[str, None, None]:
+logger = logging.getLogger(__name__)
+
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+
+STREAMING_NODES = {"user_guide", "itinerary_planner", "itinerary_optimizer"}
+SEARCH_CHANNELS = {"search", "research"}
+
+
+class TokenFilter:
+    # user_guide replies with a line starting with a routing marker are internal
+    # hand-offs, so each line is held back until its start rules that out, and
+    # nothing is released from the marker line on.
+
+    def __init__(self):
+        self.held: Dict[str, str] = {}
+        self.open_lines = set()
+        self.suppressed = set()
+
+    def feed(self, message: Any, node: str) -> List[str]:
+        if node not in STREAMING_NODES or not isinstance(message, AIMessage):
+            return []
+        if not isinstance(message.content, str) or not message.content or message.id in self.suppressed:
+            return []
+
+        if node != "user_guide" or not isinstance(message, AIMessageChunk):
+            return [message.content]
+
+        text, out = self.held.pop(message.id, "") + message.content, []
+        while text:
+            line, newline, rest = text.partition("\n")
+            if message.id not in self.open_lines:
+                stripped = line.lstrip()
+                if stripped.startswith(ROUTING_PREFIXES):
+                    self.suppressed.add(message.id)
+                    break
+                if not newline and any(prefix.startswith(stripped) for prefix in ROUTING_PREFIXES):
+                    self.held[message.id] = text
+                    break
+            # The rest of a line whose start is not a marker is streamed as it comes.
+            out.append(line + newline)
+            if newline:
+                self.open_lines.discard(message.id)
+            else:
+                self.open_lines.add(message.id)
+            text = rest
+        return ["".join(out)] if out else []
+
+    def flush(self) -> List[str]:
+        texts = list(self.held.values())
+        self.held.clear()
+        return texts
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def event(name: str, **data: Any) -> Dict[str, Any]:
+    return {"event": name, "data": data}
+
+
+async def turn_checkpoint(thread: str) -> Optional[str]:
+    # The checkpoint the thread's last finished (or cancelled) turn ended on,
+    # so a resent request still sees the one it started from while its run is
+    # in progress, and a repeat after the run sees a new one.
+    async for snapshot in graph.aget_state_history({"configurable": {"thread_id": thread}}):
+        if not snapshot.next:
+            return snapshot.config["configurable"]["checkpoint_id"]
+    return None
+
+
+async def record_cancellation(config: Dict[str, Any]) -> None:
+    # Keeps the writes of nodes that already finished, drops the pending ones
+    # and marks the checkpoint, so the next turn starts from a clean state.
+    CANCELLATIONS.inc()
+    try:
+        await graph.aupdate_state({**config, "metadata": {"cancelled": True}}, None, as_node=END)
+    except Exception as e:
+        logger.warning("Could not record cancelled run: %s", e)
+
+
+async def run_graph(graph_input: Dict[str, Any], config: Dict[str, Any], stream_mode: List[str],
+                    thread: str, queue: asyncio.Queue, budget_s: Optional[float] = None) -> None:
+    async with thread_lock(thread):
+        # The budget covers the run, not the wait for an earlier run on the thread.
+        with_deadline(config, budget_s)
+        try:
+            async for chunk in graph.astream(graph_input, config, stream_mode=stream_mode):
+                queue.put_nowait(chunk)
+        except asyncio.CancelledError:
+            await record_cancellation(config)
+            raise
+
+
+async def watch_disconnect(is_disconnected: Callable[[], Awaitable[bool]], run: asyncio.Task) -> None:
+    while not run.done():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+        if await is_disconnected():
+            run.cancel()
+
+
+async def graph_chunks(graph_input: Dict[str, Any], config: Dict[str, Any], stream_mode: List[str], thread: str,
+                       is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+                       budget_s: Optional[float] = None) -> AsyncGenerator[Any, None]:
+    # The graph runs in its own task so it can be cancelled - together with its
+    # pending model calls and searches - when the client goes away, whether that
+    # is noticed by polling or by the response stream being closed.
+    done = object()
+    queue: asyncio.Queue = asyncio.Queue()
+    run = asyncio.create_task(run_graph(graph_input, config, stream_mode, thread, queue, budget_s))
+    run.add_done_callback(lambda _: queue.put_nowait(done))
+    watcher = asyncio.create_task(watch_disconnect(is_disconnected, run)) if is_disconnected else None
+
+    try:
+        while (chunk := await queue.get()) is not done:
+            yield chunk
+        if run.cancelled():
+            raise ClientDisconnected()
+        run.result()
+    finally:
+        run.cancel()
+        if watcher:
+            watcher.cancel()
+
+
+async def chat_events(user_input: str, thread: str, stream_tokens: bool = True, budget_s: Optional[float] = None,
+                      is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncGenerator[Dict[str, Any], None]:
 
     if not user_input.strip():
-        yield "Error: Empty input"
+        yield event("error", message="Error: Empty input")
         return
-        
+
+    request_id = uuid.uuid4().hex
+    callbacks = [MetricsCallbackHandler(), UsageCallbackHandler(thread, request_id)]
+    config = {"configurable": {"thread_id": thread}, "callbacks": callbacks}
+    graph_input = {"messages": [{"role": "user", "content": user_input}]}
+    stream_mode = ["debug", "messages", "custom"] if stream_tokens else ["debug"]
+
+    token_filter = TokenFilter()
+    started: Dict[str, float] = {}
+    output: List[str] = []
+    written: Set[str] = set()
+    degradations: List[Dict[str, Any]] = []
+
     try:
-        config = {"configurable": {"thread_id": thread}}
-
-        for event in graph.stream(
-            {"messages": [{"role": "user", "content": user_input}]},
-            config
-        ):
-            for value in event.values():
-                if "messages" in value:
-                    yield value['messages'][-1].content
-    
+        async for mode, chunk in graph_chunks(graph_input, config, stream_mode, thread, is_disconnected, budget_s):
+            if mode == "custom":
+                # Text a node streams itself (map-reduce itinerary segments).
+                written.add(chunk["node"])
+                output.append(chunk["text"])
+                yield event("token", node=chunk["node"], text=chunk["text"])
+                continue
+
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                if node in written:
+                    continue
+                for text in token_filter.feed(message, node):
+                    output.append(text)
+                    yield event("token", node=node, text=text)
+                continue
+
+            payload = chunk.get("payload", {})
+            node = payload.get("name")
+
+            if chunk["type"] == "task":
+                started[payload["id"]] = time.perf_counter()
+                yield event("node_started", node=node, step=chunk["step"])
+
+            elif chunk["type"] == "task_result":
+                for channel, value in payload["result"]:
+                    if channel == "degradations":
+                        for item in value:
+                            degradations.append(item)
+                            yield event("degradation", **item)
+                    elif channel == "itinerary_patch":
+                        yield event("itinerary_patch", node=node,
+                                    days=[{"label": day["label"], "text": day["text"]} for day in value])
+                    elif channel in SEARCH_CHANNELS:
+                        yield event("search_batch_done", node=node,
+                                    queries=sum(len(batch) for batch in value))
+                    elif channel == "messages" and not stream_tokens:
+                        for text in token_filter.feed(value[-1], node):
+                            output.append(text)
+                            yield event("token", node=node, text=text)
+
+                duration = time.perf_counter() - started.pop(payload["id"], time.perf_counter())
+                NODE_DURATION.labels(node).observe(duration)
+                yield event("node_finished", node=node, step=chunk["step"],
+                            duration_ms=round(duration * 1000, 1),
+                            error=str(payload["error"]) if payload["error"] else None)
+
+        for text in token_filter.flush():
+            output.append(text)
+            yield event("token", node="user_guide", text=text)
+
+        yield event("final", text="".join(output), degradations=degradations, request_id=request_id)
+
+    except ClientDisconnected:
+        return
     except Exception as e:
-        yield f"Chat Error: {e} \n\n Please try again or start a new session."
-        return
\ No newline at end of file
+        yield event("error", message=f"Chat Error: {e} \n\n Please try again or start a new session.")
+
+
+async def event_text(events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[str, None]:
+    async for item in events:
+        if item["event"] == "token":
+            yield item["data"]["text"]
+        elif item["event"] == "error":
+            yield item["data"]["message"]
+
+
+async def chat(user_input: str, thread: str, stream_tokens: bool = True, budget_s: Optional[float] = None,
+               is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None) -> AsyncGenerator[str, None]:
+
+    async for text in event_text(chat_events(user_input, thread, stream_tokens, budget_s, is_disconnected)):
+        yield text
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Dict, NamedTuple, Optional, TypeVar
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from my_agent.utils.metrics import DEGRADATIONS
+
+load_dotenv()
+
+T = TypeVar("T")
+
+BUDGET_CONFIG = {
+    "default_seconds": float(os.getenv("REQUEST_BUDGET_SECONDS", "120")),
+    "planner_reserve_seconds": float(os.getenv("BUDGET_PLANNER_RESERVE_SECONDS", "30")),
+    "full_search_seconds": float(os.getenv("BUDGET_FULL_SEARCH_SECONDS", "20")),
+    "min_search_seconds": float(os.getenv("BUDGET_MIN_SEARCH_SECONDS", "5")),
+    "reduced_query_count": int(os.getenv("BUDGET_REDUCED_QUERY_COUNT", "2")),
+    "summary_min_seconds": float(os.getenv("BUDGET_SUMMARY_MIN_SECONDS", "60")),
+}
+
+
+class SearchBudget(NamedTuple):
+    mode: str
+    max_queries: Optional[int] = None
+    timeout: Optional[float] = None
+
+
+def with_deadline(config: Dict[str, Any], budget_seconds: Optional[float]) -> Dict[str, Any]:
+    # The deadline is a monotonic timestamp; a budget of 0 disables it.
+    budget_seconds = BUDGET_CONFIG["default_seconds"] if budget_seconds is None else budget_seconds
+    if budget_seconds > 0:
+        config["configurable"]["deadline"] = time.monotonic() + budget_seconds
+    return config
+
+
+def remaining(config: Optional[RunnableConfig]) -> Optional[float]:
+    deadline = (config or {}).get("configurable", {}).get("deadline")
+    return None if deadline is None else deadline - time.monotonic()
+
+
+async def within_budget(call: Awaitable[T], config: Optional[RunnableConfig]) -> T:
+    # Raises asyncio.TimeoutError once the deadline passes.
+    left = remaining(config)
+    if left is None:
+        return await call
+    return await asyncio.wait_for(call, max(left, 0))
+
+
+def search_budget(config: Optional[RunnableConfig]) -> SearchBudget:
+    # Searches only get the time left after the itinerary planner's reserve.
+    left = remaining(config)
+    if left is None:
+        return SearchBudget("full")
+
+    available = left - BUDGET_CONFIG["planner_reserve_seconds"]
+    if available >= BUDGET_CONFIG["full_search_seconds"]:
+        return SearchBudget("full", timeout=available)
+    if available >= BUDGET_CONFIG["min_search_seconds"]:
+        return SearchBudget("reduced", BUDGET_CONFIG["reduced_query_count"], available)
+    if available > 0:
+        return SearchBudget("cache_only")
+    return SearchBudget("skip")
+
+
+def degradation(node: str, kind: str, config: Optional[RunnableConfig]) -> Dict[str, Any]:
+    DEGRADATIONS.labels(node, kind).inc()
+    left = remaining(config)
+    return {"node": node, "kind": kind, "remaining_s": None if left is None else round(left, 1)}
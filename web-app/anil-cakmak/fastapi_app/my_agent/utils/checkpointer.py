@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_CONFIG = {
+    "backend": os.getenv("CHECKPOINTER", "sqlite"),
+    "path": os.getenv("CHECKPOINT_DB_PATH", "checkpoints.sqlite"),
+    "max_checkpoints_per_thread": int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "10")),
+    "thread_ttl_seconds": float(os.getenv("CHECKPOINT_THREAD_TTL_SECONDS", str(7 * 24 * 3600))),
+    "max_threads": int(os.getenv("CHECKPOINT_MAX_THREADS", "10000")),
+    "compaction_interval_seconds": float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL_SECONDS", "600")),
+    "compress_min_bytes": int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "1024")),
+    "busy_timeout_seconds": float(os.getenv("CHECKPOINT_BUSY_TIMEOUT_SECONDS", "30")),
+    "workers": int(os.getenv("WEB_CONCURRENCY", "1")),
+}
+
+COMPRESSED_PREFIX = "zlib:"
+
+
+class CompressedSerializer(JsonPlusSerializer):
+
+    def __init__(self, min_bytes: int = 1024):
+        super().__init__()
+        self.min_bytes = min_bytes
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if len(data) >= self.min_bytes:
+            return COMPRESSED_PREFIX + type_, zlib.compress(data)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.startswith(COMPRESSED_PREFIX):
+            return super().loads_typed((type_[len(COMPRESSED_PREFIX):], zlib.decompress(payload)))
+        return super().loads_typed(data)
+
+
+class BoundedSqliteSaver(SqliteSaver):
+    # SqliteSaver with compressed blobs, a per-thread checkpoint cap and
+    # TTL/LRU eviction of idle threads. Async methods run the sync ones in a
+    # worker thread; SQLite calls are short and serialized by self.lock.
+
+    def __init__(self, conn: sqlite3.Connection, *, max_checkpoints_per_thread: int = 10,
+                 thread_ttl_seconds: float = 7 * 24 * 3600, max_threads: int = 10000,
+                 compress_min_bytes: int = 1024):
+        super().__init__(conn, serde=CompressedSerializer(compress_min_bytes))
+        self.max_checkpoints_per_thread = max_checkpoints_per_thread
+        self.thread_ttl_seconds = thread_ttl_seconds
+        self.max_threads = max_threads
+
+    @classmethod
+    def from_path(cls, path: str, busy_timeout_seconds: float = 30, **kwargs: Any) -> "BoundedSqliteSaver":
+        # WAL mode (set by SqliteSaver.setup) plus a busy timeout lets several
+        # worker processes share one database file.
+        conn = sqlite3.connect(path, timeout=busy_timeout_seconds, check_same_thread=False)
+        return cls(conn, **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+
+        self.conn.executescript(
+            """
+            PRAGMA auto_vacuum=INCREMENTAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS thread_activity (
+                thread_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_activity_last_access ON thread_activity (last_access);
+            """
+        )
+        super().setup()
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = str(saved["configurable"]["thread_id"])
+        checkpoint_ns = saved["configurable"]["checkpoint_ns"]
+
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, last_access) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            cur.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                       SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                       ORDER BY checkpoint_id DESC LIMIT ?)""",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.max_checkpoints_per_thread),
+            )
+            if cur.rowcount:
+                cur.execute(
+                    """DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                           SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)""",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    def compact(self) -> int:
+        with self.cursor() as cur:
+            cur.execute(
+                "SELECT thread_id FROM thread_activity WHERE last_access < ?",
+                (time.time() - self.thread_ttl_seconds,),
+            )
+            expired = [row[0] for row in cur.fetchall()]
+            cur.execute(
+                "SELECT thread_id FROM thread_activity ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+                (self.max_threads,),
+            )
+            evicted = set(expired) | {row[0] for row in cur.fetchall()}
+
+        for thread_id in evicted:
+            self.delete_thread(thread_id)
+
+        with self.lock:
+            self.conn.execute("PRAGMA incremental_vacuum")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return len(evicted)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+
+def build_checkpointer() -> BaseCheckpointSaver:
+    if CHECKPOINT_CONFIG["backend"] == "memory":
+        if CHECKPOINT_CONFIG["workers"] > 1:
+            raise ValueError("CHECKPOINTER=memory cannot share sessions between workers; use CHECKPOINTER=sqlite")
+        return MemorySaver()
+    if CHECKPOINT_CONFIG["backend"] != "sqlite":
+        raise ValueError(f"Unknown CHECKPOINTER backend: {CHECKPOINT_CONFIG['backend']}")
+
+    return BoundedSqliteSaver.from_path(
+        CHECKPOINT_CONFIG["path"],
+        busy_timeout_seconds=CHECKPOINT_CONFIG["busy_timeout_seconds"],
+        max_checkpoints_per_thread=CHECKPOINT_CONFIG["max_checkpoints_per_thread"],
+        thread_ttl_seconds=CHECKPOINT_CONFIG["thread_ttl_seconds"],
+        max_threads=CHECKPOINT_CONFIG["max_threads"],
+        compress_min_bytes=CHECKPOINT_CONFIG["compress_min_bytes"],
+    )
+
+
+async def run_compaction(checkpointer: BaseCheckpointSaver) -> None:
+    if not isinstance(checkpointer, BoundedSqliteSaver):
+        return
+    while True:
+        await asyncio.sleep(CHECKPOINT_CONFIG["compaction_interval_seconds"])
+        try:
+            await asyncio.to_thread(checkpointer.compact)
+        except sqlite3.Error as e:
+            logger.warning("Checkpoint compaction failed: %s", e)
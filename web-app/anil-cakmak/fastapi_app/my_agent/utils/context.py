@@ -0,0 +1,74 @@
+import math
+import os
+import re
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from my_agent.utils.metrics import CONTEXT_TOKENS_SAVED
+from my_agent.utils.tokens import estimate_tokens
+
+load_dotenv()
+
+# Token budget for the search context of each node that consumes search results.
+CONTEXT_CONFIG = {
+    "itinerary_planner": int(os.getenv("CONTEXT_TOKENS_ITINERARY_PLANNER", "1500")),
+    "itinerary_optimizer": int(os.getenv("CONTEXT_TOKENS_ITINERARY_OPTIMIZER", "1000")),
+    "itinerary_segment": int(os.getenv("CONTEXT_TOKENS_ITINERARY_SEGMENT", "600")),
+}
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is", "it", "of", "on", "or",
+    "that", "the", "this", "to", "was", "with", "you", "your", "can", "will", "which", "also", "there", "their",
+}
+
+
+def _terms(text: str) -> List[str]:
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+
+def _sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence.strip()]
+
+
+def _relevance(snippet: str, reference: set) -> float:
+    terms = _terms(snippet)
+    if not terms:
+        return 0.0
+    return sum(term in reference for term in terms) / math.sqrt(len(terms))
+
+
+def build_context(node: str, batches: Optional[List[Dict[str, Optional[str]]]], reference: str) -> str:
+    # Renders search answers as "- query: answer" lines. Errors and empty
+    # answers are dropped, sentences already seen in another answer are removed,
+    # and the remaining snippets are kept in order of relevance to `reference`
+    # until the node's token budget is spent.
+    raw = str(batches or [])
+    seen, snippets = set(), []
+    for batch in batches or []:
+        for query, answer in (batch or {}).items():
+            if not isinstance(answer, str) or not answer.strip() or answer.startswith("Error:"):
+                continue
+            sentences = []
+            for sentence in _sentences(answer):
+                fact = " ".join(_terms(sentence))
+                if fact and fact not in seen:
+                    seen.add(fact)
+                    sentences.append(sentence)
+            if sentences:
+                snippets.append(f"- {query}: {' '.join(sentences)}")
+
+    reference_terms = set(_terms(reference))
+    ranked = sorted(snippets, key=lambda snippet: _relevance(snippet, reference_terms), reverse=True)
+
+    budget = CONTEXT_CONFIG.get(node)
+    kept, used = [], 0
+    for snippet in ranked:
+        tokens = estimate_tokens(snippet) + 1
+        if budget is not None and used + tokens > budget:
+            continue
+        kept.append(snippet)
+        used += tokens
+
+    context = "\n".join(kept) if kept else "No search results available."
+    CONTEXT_TOKENS_SAVED.labels(node).inc(max(0, estimate_tokens(raw) - estimate_tokens(context)))
+    return context
+
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from my_agent.utils.kvstore import SqliteTTLStore
+from my_agent.utils.metrics import IDEMPOTENT_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_CONFIG = {
+    "enabled": os.getenv("IDEMPOTENCY", "on") == "on",
+    "path": os.getenv("IDEMPOTENCY_DB_PATH", "idempotency.sqlite"),
+    # completed runs requested with an Idempotency-Key header are replayed this long
+    "ttl_seconds": float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(3600))),
+    # without the header the key is thread + last finished turn + input, so a
+    # message repeated on purpose after the run is not a duplicate; the short
+    # ttl only bounds how long retries of a finished run are replayed
+    "derived_ttl_seconds": float(os.getenv("IDEMPOTENCY_DERIVED_TTL_SECONDS", "30")),
+    # how long a run in another worker holds off its duplicates
+    "running_ttl_seconds": float(os.getenv("IDEMPOTENCY_RUNNING_TTL_SECONDS", "300")),
+    "poll_seconds": float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.25")),
+}
+
+Disconnected = Callable[[], Awaitable[bool]]
+
+_store: Optional[SqliteTTLStore] = None
+
+
+def idempotency_store() -> SqliteTTLStore:
+    global _store
+    if _store is None:
+        _store = SqliteTTLStore(IDEMPOTENCY_CONFIG["path"], "idempotency")
+    return _store
+
+
+def request_key(thread: str, user_input: str, header: Optional[str],
+                checkpoint: Optional[str] = None) -> Tuple[str, float]:
+    # The key and how long the completed run is replayed. checkpoint is where
+    # the thread's last finished turn ended, see chat.turn_checkpoint.
+    if header:
+        parts, ttl_seconds = [thread, "key", header], IDEMPOTENCY_CONFIG["ttl_seconds"]
+    else:
+        parts, ttl_seconds = [thread, "input", checkpoint, user_input], IDEMPOTENCY_CONFIG["derived_ttl_seconds"]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest(), ttl_seconds
+
+
+class SharedRun:
+    # Events of one run, buffered so clients attaching late still get all of
+    # them. The run is cancelled once every attached client has gone away.
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.changed = asyncio.Condition()
+        self.clients: List[Optional[Disconnected]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, item: Dict[str, Any]) -> None:
+        async with self.changed:
+            self.events.append(item)
+            self.changed.notify_all()
+
+    async def finish(self) -> None:
+        async with self.changed:
+            self.done = True
+            self.changed.notify_all()
+
+    async def disconnected(self) -> bool:
+        for client in list(self.clients):
+            if client is None or not await client():
+                return False
+        return True
+
+    async def follow(self, client: Optional[Disconnected]) -> AsyncGenerator[Dict[str, Any], None]:
+        self.clients.append(client)
+        try:
+            sent = 0
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: self.done or len(self.events) > sent)
+                    pending, done = self.events[sent:], self.done
+                for item in pending:
+                    yield item
+                sent += len(pending)
+                if done and sent == len(self.events):
+                    return
+        finally:
+            self.clients.remove(client)
+
+
+_runs: Dict[str, SharedRun] = {}
+
+
+def _completed(events: List[Dict[str, Any]]) -> bool:
+    return bool(events) and events[-1]["event"] == "final"
+
+
+async def _produce(key: str, ttl_seconds: float, run: SharedRun,
+                   start: Callable[[Disconnected], AsyncIterator[Dict[str, Any]]]) -> None:
+    # Only runs that reached their final event are kept for replay; failed and
+    # cancelled ones release the key so a retry runs again.
+    try:
+        async for item in start(run.disconnected):
+            await run.publish(item)
+    except Exception as e:
+        # Nobody awaits the task, so the attached clients get the error instead.
+        logger.warning("Run failed: %s", e)
+        await run.publish({"event": "error", "data": {"message": f"Error: {e}"}})
+    finally:
+        await run.finish()
+        _runs.pop(key, None)
+        store = idempotency_store()
+        if _completed(run.events):
+            record = json.dumps({"status": "done", "events": run.events}).encode()
+            await asyncio.to_thread(store.set, key, record, ttl_seconds)
+        else:
+            await asyncio.to_thread(store.delete, key)
+
+
+def _claim(key: str) -> Optional[Dict[str, Any]]:
+    # None if this worker now owns the key, else the stored record.
+    store = idempotency_store()
+    running = json.dumps({"status": "running"}).encode()
+    if store.add(key, running, IDEMPOTENCY_CONFIG["running_ttl_seconds"]):
+        return None
+    raw = store.get(key)
+    return json.loads(raw) if raw is not None else {"status": "expired"}
+
+
+async def idempotent_events(key: str, ttl_seconds: float,
+                            start: Callable[[Disconnected], AsyncIterator[Dict[str, Any]]],
+                            is_disconnected: Optional[Disconnected] = None) -> AsyncGenerator[Dict[str, Any], None]:
+    # Duplicates of a running request follow its events (live in this worker,
+    # from the store once it completes in another one); duplicates of a
+    # completed request replay its stored events.
+    if not IDEMPOTENCY_CONFIG["enabled"]:
+        async for item in start(is_disconnected):
+            yield item
+        return
+
+    result = "attached"
+    while (run := _runs.get(key)) is None:
+        record = await asyncio.to_thread(_claim, key)
+        if (run := _runs.get(key)) is not None:
+            break
+        if record is None:
+            run = _runs[key] = SharedRun()
+            run.task = asyncio.create_task(_produce(key, ttl_seconds, run, start))
+            result = "started"
+            break
+        if record["status"] == "done":
+            IDEMPOTENT_REQUESTS.labels("replayed").inc()
+            for item in record["events"]:
+                yield item
+            return
+        if is_disconnected is not None and await is_disconnected():
+            return
+        await asyncio.sleep(IDEMPOTENCY_CONFIG["poll_seconds"])
+
+    IDEMPOTENT_REQUESTS.labels(result).inc()
+    async for item in run.follow(is_disconnected):
+        yield item
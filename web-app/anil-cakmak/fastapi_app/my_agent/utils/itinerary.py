@@ -0,0 +1,125 @@
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+from my_agent.utils.query_templates import ParsedPlan
+
+load_dotenv()
+
+ITINERARY_CONFIG = {
+    # auto: map-reduce when the plan has at least min_cities cities and min_days
+    # days (shorter trips are quick to write in one call); on / off force it
+    "map_reduce": os.getenv("ITINERARY_MAP_REDUCE", "auto"),
+    "min_cities": int(os.getenv("ITINERARY_MAP_REDUCE_MIN_CITIES", "2")),
+    "min_days": int(os.getenv("ITINERARY_MAP_REDUCE_MIN_DAYS", "7")),
+}
+
+
+class Segment(NamedTuple):
+    country: str
+    city: str
+    places: List[str]
+    first_day: int
+    last_day: int
+    previous_stop: str
+    next_stop: str
+
+
+def trip_days(plan: ParsedPlan) -> Optional[int]:
+    match = re.search(r"(\d+)\s*(day|night|week)", (plan.duration or "").lower())
+    if not match:
+        return None
+    count, unit = int(match.group(1)), match.group(2)
+    return count * 7 if unit == "week" else count + 1 if unit == "night" else count
+
+
+def plan_segments(plan: Optional[ParsedPlan]) -> Optional[List[Segment]]:
+    # One segment per city with an even share of the trip's days (earlier cities
+    # get the remainder). None means the itinerary is written in one call.
+    if plan is None or ITINERARY_CONFIG["map_reduce"] == "off":
+        return None
+    stops = [(country, city, places if isinstance(places, list) else [])
+             for country, cities in plan.destinations.items() for city, places in cities.items()]
+    days = trip_days(plan)
+    if days is None or days < len(stops) or (ITINERARY_CONFIG["map_reduce"] == "auto" and (
+            len(stops) < ITINERARY_CONFIG["min_cities"] or days < ITINERARY_CONFIG["min_days"])):
+        return None
+
+    segments, first_day = [], 1
+    share, extra = divmod(days, len(stops))
+    for i, (country, city, places) in enumerate(stops):
+        last_day = first_day + share + (i < extra) - 1
+        segments.append(Segment(country, city, [str(place) for place in places], first_day, last_day,
+                                stops[i - 1][1] if i else plan.departure,
+                                stops[i + 1][1] if i + 1 < len(stops) else plan.departure))
+        first_day = last_day + 1
+    return segments
+
+
+def segment_results(batches: List[Dict[str, str]], segment: Segment) -> List[Dict[str, str]]:
+    # The slice of search results that mention the segment's city.
+    city = segment.city.lower()
+    return [{query: answer for query, answer in (batch or {}).items()
+             if city in query.lower() or (isinstance(answer, str) and city in answer.lower())}
+            for batch in batches]
+
+
+DAY_HEADING = re.compile(r"^\W*days?\s+(\d+)(?:\s*(?:-|–|to)\s*(\d+))?\b", re.IGNORECASE)
+GENERIC_TERMS = {"day", "days", "change", "replace", "instead", "hotel", "hotels", "please", "want", "would",
+                 "like", "trip", "itinerary", "something", "another", "different", "better", "make", "add"}
+
+
+def split_days(text: str) -> List[Dict[str, Any]]:
+    # Splits an itinerary into day blocks keyed by their "Day N" / "Days N-M"
+    # heading; text before the first heading becomes an unlabelled block. A
+    # heading for a day the current block already covers ("Day 4 evening"
+    # under "Days 4-5") stays in that block.
+    blocks: List[Dict[str, Any]] = []
+    for line in text.splitlines():
+        match = DAY_HEADING.match(line)
+        if match and (not blocks or int(match.group(1)) > blocks[-1]["last"]):
+            first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+            label = f"Day {first}" if first == last else f"Days {first}-{last}"
+            blocks.append({"label": label, "first": first, "last": last, "lines": []})
+        elif not blocks:
+            blocks.append({"label": None, "first": 0, "last": 0, "lines": []})
+        blocks[-1]["lines"].append(line)
+
+    blocks = [{"label": block["label"], "first": block["first"], "last": block["last"],
+               "text": "\n".join(block["lines"]).strip()} for block in blocks]
+    blocks = [block for block in blocks if block["text"]]
+    return blocks if any(block["label"] for block in blocks) else []
+
+
+def render_days(blocks: List[Dict[str, Any]]) -> str:
+    return "\n\n".join(block["text"] for block in blocks)
+
+
+def parse_refine(task: str) -> Tuple[str, str]:
+    # (traveler's request, itinerary text) from a "Refine:" task.
+    request = re.search(r"Traveler's Request\s*:\s*(.*?)(?=^\s*Itinerary\s*:|\Z)", task, re.S | re.M | re.I)
+    itinerary = re.search(r"^\s*Itinerary\s*:\s*(.*)\Z", task, re.S | re.M | re.I)
+    return (request.group(1).strip() if request else task.strip(),
+            itinerary.group(1).strip() if itinerary else "")
+
+
+def affected_days(blocks: List[Dict[str, Any]], request: str) -> List[int]:
+    # Indexes of the day blocks a refine request touches: the days it names,
+    # otherwise the days mentioning its specific terms (places, hotels), and
+    # every block when neither narrows it down.
+    days = [int(day) for day in re.findall(r"\bday\s+(\d+)", request, re.I)]
+    if days:
+        indexes = [i for i, block in enumerate(blocks)
+                   if block["label"] and any(block["first"] <= day <= block["last"] for day in days)]
+    else:
+        terms = {term for term in re.findall(r"\w{4,}", request.lower()) if term not in GENERIC_TERMS}
+        indexes = [i for i, block in enumerate(blocks)
+                   if block["label"] and terms & set(re.findall(r"\w{4,}", block["text"].lower()))]
+    return indexes or list(range(len(blocks)))
+
+
+def merge_days(blocks: List[Dict[str, Any]], patch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    updated = {block["label"]: block for block in patch if block["label"]}
+    merged = [updated.pop(block["label"], block) for block in blocks]
+    merged += updated.values()
+    return sorted(merged, key=lambda block: block["first"])
@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+PURGE_EVERY_WRITES = 256
+
+
+class SqliteTTLStore:
+    # Small key/value table with per-entry expiry, shared by the on-disk caches.
+    # WAL mode and a busy timeout let several worker processes use one file.
+    # Expired rows stay readable as stale fallbacks for stale_grace_seconds and
+    # are purged every PURGE_EVERY_WRITES writes after that.
+
+    def __init__(self, path: str, table: str, busy_timeout_seconds: float = 30, stale_grace_seconds: float = 0):
+        self.table = table
+        self.stale_grace_seconds = stale_grace_seconds
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout_seconds, check_same_thread=False)
+        self.conn.executescript(
+            f"""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at);
+            """
+        )
+
+    def get(self, key: str, allow_stale: bool = False) -> Optional[bytes]:
+        oldest = time.time() - (self.stale_grace_seconds if allow_stale else 0)
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?", (key, oldest)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl_seconds),
+            )
+            self.writes += 1
+            if self.writes % PURGE_EVERY_WRITES == 0:
+                self.conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?",
+                                  (time.time() - self.stale_grace_seconds,))
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        # Sets the key only if it has no live entry; True if this call set it.
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                f"INSERT INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?) "
+                f"ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                f"WHERE {self.table}.expires_at <= ?",
+                (key, value, now + ttl_seconds, now),
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, key: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(f"DELETE FROM {self.table}")
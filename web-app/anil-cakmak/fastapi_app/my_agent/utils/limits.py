@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from dotenv import load_dotenv
+from my_agent.utils.metrics import LIMITER_QUEUE_DEPTH, LIMITER_WAIT
+
+load_dotenv()
+
+TAVILY_LIMITS = {
+    "rate_per_second": float(os.getenv("TAVILY_RATE_PER_SECOND", "10")),
+    "burst": int(os.getenv("TAVILY_BURST", "20")),
+    "max_in_flight": int(os.getenv("TAVILY_MAX_IN_FLIGHT", os.getenv("SEARCH_MAX_CONCURRENCY", "10"))),
+}
+
+OPENAI_DEFAULT_LIMITS = {
+    "rate_per_second": float(os.getenv("OPENAI_RATE_PER_SECOND", "5")),
+    "burst": int(os.getenv("OPENAI_BURST", "10")),
+    "max_in_flight": int(os.getenv("OPENAI_MAX_IN_FLIGHT", "32")),
+}
+
+# Per-model overrides, e.g. {"gpt-4o-mini": {"rate_per_second": 20, "max_in_flight": 64}}
+OPENAI_MODEL_LIMITS: Dict[str, Dict] = json.loads(os.getenv("OPENAI_MODEL_LIMITS", "{}"))
+
+
+class RateLimiter:
+    # Token bucket (GCRA) plus a cap on calls in flight. Callers queue instead
+    # of failing: each one reserves the next free slot and sleeps until then.
+    # The bucket is shared by every event loop in the process; the in-flight
+    # semaphore is per loop because asyncio primitives are loop-bound.
+
+    def __init__(self, name: str, rate_per_second: float, burst: int, max_in_flight: int):
+        self.name = name
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0
+        self.burst = max(burst, 1)
+        self.max_in_flight = max_in_flight
+        self._theoretical_arrival = 0.0
+        self._lock = threading.Lock()
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if (semaphore := self._semaphores.get(loop)) is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return semaphore
+
+    def _reserve(self) -> float:
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._theoretical_arrival = max(self._theoretical_arrival, now)
+            delay = max(0.0, self._theoretical_arrival - now - (self.burst - 1) * self.interval)
+            self._theoretical_arrival += self.interval
+            return delay
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[None]:
+        semaphore = self._semaphore()
+        started = time.perf_counter()
+        LIMITER_QUEUE_DEPTH.labels(self.name).inc()
+        try:
+            await semaphore.acquire()
+            try:
+                if delay := self._reserve():
+                    await asyncio.sleep(delay)
+            except BaseException:
+                semaphore.release()
+                raise
+        finally:
+            LIMITER_QUEUE_DEPTH.labels(self.name).dec()
+            LIMITER_WAIT.labels(self.name).observe(time.perf_counter() - started)
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _get_limiter(name: str, limits: Dict) -> RateLimiter:
+    with _limiters_lock:
+        if (limiter := _limiters.get(name)) is None:
+            limiter = _limiters[name] = RateLimiter(name, **limits)
+        return limiter
+
+
+def tavily_limiter() -> RateLimiter:
+    return _get_limiter("tavily", TAVILY_LIMITS)
+
+
+def openai_limiter(model: Optional[str]) -> RateLimiter:
+    model = model or "default"
+    return _get_limiter(f"openai:{model}", {**OPENAI_DEFAULT_LIMITS, **OPENAI_MODEL_LIMITS.get(model, {})})
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+from dotenv import load_dotenv
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration
+from my_agent.utils.kvstore import SqliteTTLStore
+from my_agent.utils.metrics import LLM_CACHE_REQUESTS
+
+load_dotenv()
+
+LLM_CACHE_CONFIG = {
+    "mode": os.getenv("LLM_CACHE", "memory"),
+    "max_entries": int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024")),
+    "path": os.getenv("LLM_CACHE_DB_PATH", "llm_cache.sqlite"),
+    "ttl_seconds": float(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600))),
+    "skip_nodes": {node.strip() for node in os.getenv("LLM_CACHE_SKIP_NODES", "user_guide").split(",") if node.strip()},
+}
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode()).hexdigest()
+
+
+def replayed_message(message: BaseMessage) -> BaseMessage:
+    # Replayed messages must not reuse the original message id (add_messages
+    # would replace the earlier message) or report token usage that was not spent.
+    message = message.model_copy(update={"id": None})
+    if isinstance(message, AIMessage):
+        message.usage_metadata = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    return message
+
+
+def _strip_generation(generation: Any) -> Any:
+    if isinstance(generation, ChatGeneration):
+        return ChatGeneration(message=replayed_message(generation.message), generation_info=generation.generation_info)
+    return generation
+
+
+class TieredLLMCache(BaseCache):
+    # Exact-match response cache: an in-process LRU in front of an optional
+    # SQLite tier with TTL. The key hashes the model parameters (llm_string,
+    # which includes bound tools/response formats) and the serialized prompt.
+
+    def __init__(self, max_entries: int = 1024, disk: Optional[SqliteTTLStore] = None, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.disk = disk
+        self.ttl_seconds = ttl_seconds
+        self.memory: "OrderedDict[str, RETURN_VAL_TYPE]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _memory_get(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value: RETURN_VAL_TYPE) -> None:
+        with self.lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        raw = self.disk.get(key)
+        if raw is None:
+            return None
+        return [loads(item) for item in json.loads(raw)]
+
+    def _disk_set(self, key: str, value: RETURN_VAL_TYPE) -> None:
+        self.disk.set(key, json.dumps([dumps(item) for item in value]).encode(), self.ttl_seconds)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        if (value := self._memory_get(key)) is not None:
+            LLM_CACHE_REQUESTS.labels("memory", "hit").inc()
+            return value
+        if self.disk is not None and (value := self._disk_get(key)) is not None:
+            LLM_CACHE_REQUESTS.labels("disk", "hit").inc()
+            self._memory_set(key, value)
+            return value
+        LLM_CACHE_REQUESTS.labels("all", "miss").inc()
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = cache_key(prompt, llm_string)
+        value = [_strip_generation(generation) for generation in return_val]
+        self._memory_set(key, value)
+        if self.disk is not None:
+            self._disk_set(key, value)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.disk is None:
+            return self.lookup(prompt, llm_string)
+        return await asyncio.to_thread(self.lookup, prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.disk is None:
+            return self.update(prompt, llm_string, return_val)
+        await asyncio.to_thread(self.update, prompt, llm_string, return_val)
+
+    async def aclear(self, **kwargs: Any) -> None:
+        await asyncio.to_thread(self.clear)
+
+
+def build_llm_cache() -> Optional[TieredLLMCache]:
+    mode = LLM_CACHE_CONFIG["mode"]
+    if mode == "off":
+        return None
+    if mode not in ("memory", "disk"):
+        raise ValueError(f"Unknown LLM_CACHE mode: {mode}")
+
+    disk = SqliteTTLStore(LLM_CACHE_CONFIG["path"], "llm_cache") if mode == "disk" else None
+    return TieredLLMCache(LLM_CACHE_CONFIG["max_entries"], disk, LLM_CACHE_CONFIG["ttl_seconds"])
@@ -0,0 +1,55 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from dotenv import load_dotenv
+from my_agent.utils.checkpointer import CHECKPOINT_CONFIG
+
+load_dotenv()
+
+LOCK_CONFIG = {
+    "dir": os.getenv("THREAD_LOCK_DIR", os.path.join(os.path.dirname(os.path.abspath(CHECKPOINT_CONFIG["path"])), "locks")),
+    "stripes": int(os.getenv("THREAD_LOCK_STRIPES", "1024")),
+    "timeout_seconds": float(os.getenv("THREAD_LOCK_TIMEOUT_SECONDS", "300")),
+    "poll_seconds": float(os.getenv("THREAD_LOCK_POLL_SECONDS", "0.05")),
+}
+
+_local_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _lock_path(thread: str) -> str:
+    stripe = int(hashlib.sha1(thread.encode()).hexdigest(), 16) % LOCK_CONFIG["stripes"]
+    return os.path.join(LOCK_CONFIG["dir"], f"thread-{stripe:04d}.lock")
+
+
+@asynccontextmanager
+async def thread_lock(thread: str) -> AsyncIterator[None]:
+    # Serializes runs on one conversation thread across coroutines (asyncio.Lock)
+    # and across worker processes sharing the checkpoint database (flock).
+    local_lock = _local_locks.get(thread)
+    if local_lock is None:
+        local_lock = _local_locks[thread] = asyncio.Lock()
+
+    async with local_lock:
+        os.makedirs(LOCK_CONFIG["dir"], exist_ok=True)
+        fd = os.open(_lock_path(thread), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            deadline = time.monotonic() + LOCK_CONFIG["timeout_seconds"]
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Thread {thread} is busy with another request")
+                    await asyncio.sleep(LOCK_CONFIG["poll_seconds"])
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
@@ -0,0 +1,99 @@
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+NODE_DURATION = Histogram("agent_node_duration_seconds", "Wall-clock duration of graph nodes",
+                          ["node"], buckets=LATENCY_BUCKETS)
+LLM_LATENCY = Histogram("agent_llm_call_duration_seconds", "Latency of chat model calls",
+                        ["node", "model"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("agent_llm_tokens_total", "Tokens used by chat model calls",
+                     ["node", "kind"])
+LLM_COST = Counter("agent_llm_cost_usd_total", "Estimated cost of chat model calls in USD", ["node", "model"])
+SEARCH_LATENCY = Histogram("agent_search_duration_seconds", "Latency of Tavily search calls",
+                           buckets=LATENCY_BUCKETS)
+SEARCH_ERRORS = Counter("agent_search_errors_total", "Tavily search calls that failed or returned no answer")
+ACTIVE_STREAMS = Gauge("agent_active_streams", "Responses currently streaming to clients",
+                       multiprocess_mode="livesum")
+SEARCH_CACHE_REQUESTS = Counter("agent_search_cache_requests_total", "Search cache lookups by query class",
+                                ["query_class", "result"])
+LLM_CACHE_REQUESTS = Counter("agent_llm_cache_requests_total", "LLM response cache lookups",
+                             ["tier", "result"])
+LIMITER_QUEUE_DEPTH = Gauge("agent_limiter_queue_depth", "Calls waiting for a rate limiter slot",
+                            ["limiter"], multiprocess_mode="livesum")
+LIMITER_WAIT = Histogram("agent_limiter_wait_seconds", "Time spent waiting for a rate limiter slot",
+                         ["limiter"], buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+RESILIENCE_EVENTS = Counter("agent_resilience_events_total",
+                            "Retries, hedges, breaker transitions and fallbacks by target", ["target", "event"])
+CANCELLATIONS = Counter("agent_cancellations_total", "Graph runs cancelled because the client went away")
+DEGRADATIONS = Counter("agent_degradations_total", "Work skipped or reduced to stay within the request budget",
+                       ["node", "kind"])
+QUERY_GENERATION = Counter("agent_query_generation_total", "Search query sets by how they were generated",
+                           ["node", "path"])
+QUERY_OVERLAP = Histogram("agent_query_overlap_ratio", "Word overlap of template and LLM queries in compare mode",
+                          ["node"], buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1))
+CONTEXT_TOKENS_SAVED = Counter("agent_context_tokens_saved_total",
+                               "Prompt tokens saved by compacting search results", ["node"])
+SPEND_CAP_REFUSALS = Counter("agent_spend_cap_refusals_total", "Plan flows refused because the thread hit its spending cap")
+PREFETCH_QUERIES = Counter("agent_prefetch_queries_total",
+                           "Speculative searches issued, later used by a node (hit) or dropped by the cap", ["result"])
+REFINES = Counter("agent_refines_total", "Refine flows by whether only the affected days were regenerated",
+                  ["mode"])
+SEARCH_QUERIES = Counter("agent_search_queries_total",
+                         "Node search queries by where the answer came from (cache, local_index, web, none)",
+                         ["source"])
+LOCAL_INDEX_LATENCY = Histogram("agent_local_index_duration_seconds", "Latency of local vector index lookups",
+                                buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+NODE_CACHE_REQUESTS = Counter("agent_node_cache_requests_total", "Node output cache lookups", ["node", "result"])
+IDEMPOTENT_REQUESTS = Counter("agent_idempotent_requests_total",
+                              "Agent requests that started a run, attached to a running one or replayed a stored one",
+                              ["result"])
+FLOWS = Counter("agent_flows_total", "Conversation turns by routed flow", ["flow"])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    # Runs inline on the event loop; it only reads timestamps and usage metadata.
+    run_inline = True
+
+    def __init__(self):
+        self.calls: Dict[UUID, Tuple[float, str, str]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        self.calls[run_id] = (time.perf_counter(),
+                              metadata.get("langgraph_node", "unknown"),
+                              metadata.get("ls_model_name", "unknown"))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        if (call := self.calls.pop(run_id, None)) is None:
+            return
+        started, node, model = call
+        LLM_LATENCY.labels(node, model).observe(time.perf_counter() - started)
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(node, "prompt").inc(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(node, "completion").inc(usage.get("output_tokens", 0))
+                    LLM_TOKENS.labels(node, "cached").inc((usage.get("input_token_details") or {}).get("cache_read", 0) or 0)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.calls.pop(run_id, None)
+
+
+def render_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import threading
+from dotenv import load_dotenv
+from typing import Any, AsyncIterator, Dict, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from my_agent.utils.limits import openai_limiter
+from my_agent.utils.llm_cache import LLM_CACHE_CONFIG, build_llm_cache
+from my_agent.utils.resilience import (RESILIENCE_CONFIG, CircuitBreaker, CircuitOpenError, LatencyTracker,
+                                        backoff_delay, is_retryable, resilient_call)
+from my_agent.utils.metrics import RESILIENCE_EVENTS
+
+load_dotenv()
+
+MODEL_CONFIG = {
+    "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
+    "temperature": float(os.getenv("MODEL_TEMPERATURE", "0")),
+    "api_key": os.getenv("OPENAI_API_KEY"),
+    "stream_usage": True,
+    "timeout": float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120")),
+    "max_retries": 0
+}
+
+
+_latency: Dict[str, LatencyTracker] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def _breaker(target: str) -> CircuitBreaker:
+    return _breakers.setdefault(target, CircuitBreaker(target, RESILIENCE_CONFIG["breaker_failure_threshold"],
+                                                       RESILIENCE_CONFIG["breaker_reset_seconds"]))
+
+
+class GovernedChatOpenAI(ChatOpenAI):
+    # Only the actual API calls go through the per-model limiter and the
+    # retry/hedging layer, so cache hits are never queued behind them.
+    # MODEL_CONFIG disables the OpenAI SDK's own retries in favour of these.
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        generate = super()._agenerate
+        target = f"openai:{self.model_name}"
+
+        async def call() -> ChatResult:
+            async with openai_limiter(self.model_name).acquire():
+                return await generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        return await resilient_call(call, target, _latency.setdefault(target, LatencyTracker()),
+                                    RESILIENCE_CONFIG["hedge_llm"], _breaker(target))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # Streams are retried only until the first chunk has been forwarded.
+        target = f"openai:{self.model_name}"
+        breaker = _breaker(target)
+        trial = breaker.enter()
+        if trial is None:
+            RESILIENCE_EVENTS.labels(target, "breaker_rejected").inc()
+            raise CircuitOpenError(f"{target} circuit is open")
+
+        attempts = RESILIENCE_CONFIG["retry_attempts"]
+        try:
+            for attempt in range(attempts):
+                emitted = False
+                try:
+                    async with openai_limiter(self.model_name).acquire():
+                        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                            emitted = True
+                            yield chunk
+                    breaker.record_success()
+                    return
+                except Exception as error:
+                    if emitted or attempt == attempts - 1 or not is_retryable(error):
+                        raise
+                    RESILIENCE_EVENTS.labels(target, "retry").inc()
+                    await asyncio.sleep(backoff_delay(attempt))
+        except BaseException as error:
+            # Also reached when the consumer closes the stream or is cancelled.
+            breaker.record_error(error, trial)
+            raise
+
+
+SMALL_MODEL = os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini")
+
+# Per-node overrides of MODEL_CONFIG (model, temperature, max_tokens, timeout, ...).
+# Query generation and summarizing run on the small model by default; NODE_MODELS
+# adds to or changes these, e.g. {"user_guide": {"model": "gpt-4o-mini", "max_tokens": 800}}
+NODE_MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
+    "conversation_summarizer": {"model": SMALL_MODEL, "max_tokens": 800},
+    "transport_advisor": {"model": SMALL_MODEL, "max_tokens": 400, "timeout": 30},
+    "accommodation_advisor": {"model": SMALL_MODEL, "max_tokens": 400, "timeout": 30},
+    "itinerary_researcher": {"model": SMALL_MODEL, "max_tokens": 400, "timeout": 30},
+    "itinerary_stitcher": {"model": SMALL_MODEL, "max_tokens": 300, "timeout": 30},
+}
+for _node, _settings in json.loads(os.getenv("NODE_MODELS", "{}")).items():
+    NODE_MODEL_CONFIG[_node] = {**NODE_MODEL_CONFIG.get(_node, {}), **_settings}
+
+llm_cache = build_llm_cache()
+
+_models: Dict[str, ChatOpenAI] = {}
+_models_lock = threading.Lock()
+
+
+def model_for(node: str) -> ChatOpenAI:
+    # Nodes with identical settings share one client.
+    settings = {**MODEL_CONFIG, **NODE_MODEL_CONFIG.get(node, {})}
+    cache = llm_cache if settings["temperature"] == 0 and node not in LLM_CACHE_CONFIG["skip_nodes"] else None
+    key = json.dumps({**settings, "cached": cache is not None}, sort_keys=True)
+    with _models_lock:
+        if (model := _models.get(key)) is None:
+            model = _models[key] = GovernedChatOpenAI(**settings, cache=cache or False)
+    return model
@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+from dotenv import load_dotenv
+from langchain_core.load import dumps, loads
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.types import StreamWriter
+from my_agent.utils.kvstore import SqliteTTLStore
+from my_agent.utils.llm_cache import replayed_message
+from my_agent.utils.metrics import NODE_CACHE_REQUESTS
+
+load_dotenv()
+
+NODE_CACHE_CONFIG = {
+    "enabled": os.getenv("NODE_CACHE", "off") == "on",
+    "path": os.getenv("NODE_CACHE_DB_PATH", "node_cache.sqlite"),
+    "ttl_seconds": float(os.getenv("NODE_CACHE_TTL_SECONDS", str(3600))),
+}
+
+_store: Optional[SqliteTTLStore] = None
+
+
+def node_store() -> SqliteTTLStore:
+    global _store
+    if _store is None:
+        _store = SqliteTTLStore(NODE_CACHE_CONFIG["path"], "node_cache")
+    return _store
+
+
+def node_key(node: str, state: Dict[str, Any], reads: Sequence[str]) -> str:
+    inputs = json.dumps({key: state.get(key) for key in reads}, sort_keys=True, default=str)
+    return hashlib.sha256(f"{node}\x00{inputs}".encode()).hexdigest()
+
+
+def _strip_message(value: Any) -> Any:
+    if isinstance(value, BaseMessage):
+        return replayed_message(value)
+    if isinstance(value, list):
+        return [_strip_message(item) for item in value]
+    return value
+
+
+def _complete(output: Dict[str, Any]) -> bool:
+    # Outputs cut short by the budget or holding failed searches are not reused.
+    if output.get("degradations"):
+        return False
+    batches = output.get("search", []) + output.get("research", [])
+    return not any(isinstance(answer, str) and answer.startswith("Error:")
+                   for batch in batches for answer in (batch or {}).values())
+
+
+def cached_node(node: str, fn: Callable[..., Awaitable[Dict[str, Any]]],
+                reads: Sequence[str]) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    # Memoizes a deterministic node on the state keys it reads. A hit returns
+    # the stored update without running the node, so the graph still writes
+    # the same channels and streams the same events.
+    parameters = inspect.signature(fn).parameters
+
+    async def run(state: Dict[str, Any], config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+        key = node_key(node, state, reads)
+        if (raw := await asyncio.to_thread(node_store().get, key)) is not None:
+            NODE_CACHE_REQUESTS.labels(node, "hit").inc()
+            return loads(raw.decode())
+
+        NODE_CACHE_REQUESTS.labels(node, "miss").inc()
+        injected = {"config": config, "writer": writer}
+        output = await fn(state, **{name: value for name, value in injected.items() if name in parameters})
+        if _complete(output):
+            value = dumps({channel: _strip_message(value) for channel, value in output.items()})
+            await asyncio.to_thread(node_store().set, key, value.encode(), NODE_CACHE_CONFIG["ttl_seconds"])
+        return output
+
+    return run
@@ -1,118 +1,419 @@
-import os
+import asyncio
+import json
+import logging
 import re
-from dotenv import load_dotenv
-from typing import Any, Dict, List, Literal
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
-from my_agent.utils.state import AgentState
-from my_agent.utils.tools import Queries, run_search_multiple_queries
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, RemoveMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.utils.json import parse_partial_json
+from langgraph.constants import TAG_NOSTREAM
+from langgraph.types import StreamWriter
+from my_agent.utils.context import build_context
+from my_agent.utils.itinerary import (Segment, affected_days, merge_days, parse_refine, plan_segments, render_days,
+                                      segment_results, split_days)
+from my_agent.utils.budget import BUDGET_CONFIG, SearchBudget, degradation, remaining, search_budget, within_budget
+from my_agent.utils.state import AgentState, STATE_CONFIG
+from my_agent.utils.tokens import estimate_message_tokens
+from my_agent.utils.metrics import FLOWS, QUERY_GENERATION, QUERY_OVERLAP, REFINES, SPEND_CAP_REFUSALS
+from my_agent.utils.usage import spend_cap_reached
+from my_agent.utils.models import model_for
+from my_agent.utils.tools import Queries, prefetch, search_multiple_queries
+from my_agent.utils.vector_index import VectorIndex
+from my_agent.utils.query_templates import (QUERY_GENERATION_CONFIG, ParsedPlan, accommodation_queries,
+                                            attraction_queries, parse_plan, query_overlap, transport_queries)
 from my_agent.utils.system_prompts import (user_guide_prompt, 
+                                           user_guide_current_itinerary_prompt,
                                            destination_planner_prompt,
                                            transport_advisor_prompt,
                                            accommodation_advisor_prompt,
                                            itinerary_planner_prompt,
+                                           itinerary_segment_prompt,
+                                           itinerary_stitch_prompt,
                                            itinerary_researcher_prompt,
-                                           itinerary_optimizer_prompt)
+                                           itinerary_optimizer_prompt,
+                                           itinerary_days_optimizer_prompt,
+                                           conversation_summarizer_prompt)
 
+logger = logging.getLogger(__name__)
 
-load_dotenv()
 
-MODEL_CONFIG = {
-    "model": os.getenv("OPENAI_MODEL", "gpt-4o"),
-    "temperature": float(os.getenv("MODEL_TEMPERATURE", "0")),
-    "api_key": os.getenv("OPENAI_API_KEY")
-}
+async def conversation_summarizer_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
 
+    window = STATE_CONFIG["message_window"]
+    if len(state['messages']) <= window or \
+            estimate_message_tokens(state['messages']) <= STATE_CONFIG["summary_token_threshold"]:
+        return {}
 
-model = ChatOpenAI(**MODEL_CONFIG)
+    # Summarizing can wait for a turn with more time to spare.
+    left = remaining(config)
+    if left is not None and left < BUDGET_CONFIG["summary_min_seconds"]:
+        return {"degradations": [degradation("conversation_summarizer", "summary_deferred", config)]}
 
+    older = state['messages'][:-window]
+    transcript = "\n\n".join(f"{message.type}: {message.content}" for message in older)
+
+    response = await model_for("conversation_summarizer").ainvoke([
+        SystemMessage(content=conversation_summarizer_prompt),
+        HumanMessage(content=f"Existing summary:\n{state.get('summary', '')}\n\nNew conversation lines:\n{transcript}")
+    ])
+
+    return {"summary": response.content, "messages": [RemoveMessage(id=message.id) for message in older]}
+
+
+# A hand-off is a user_guide reply with a line starting with a routing marker;
+# the streamed token filter holds back the same lines.
+ROUTING_PREFIXES = ("Plan:", "Refine:")
+ROUTING_MARKER = re.compile(r"^\s*(Plan:|Refine:)", re.MULTILINE)
+
+
+def routing_marker(text: str) -> Optional[str]:
+    match = ROUTING_MARKER.search(text)
+    return match.group(1) if match else None
 
-def user_guide_node(state: AgentState) -> Dict[str, Any]:
 
-    messages = [SystemMessage(content=user_guide_prompt)] + state['messages']
+async def user_guide_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
 
-    response = model.invoke(messages)
+    messages = [SystemMessage(content=user_guide_prompt)]
+    if state.get('summary'):
+        messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}"))
+    if state.get('itinerary'):
+        messages.append(SystemMessage(content=user_guide_current_itinerary_prompt))
+    messages += state['messages']
 
-    if "Plan:" in response.content:
+    response = await model_for("user_guide").ainvoke(messages)
+
+    marker = routing_marker(response.content)
+    if marker == "Plan:":
+        if await asyncio.to_thread(spend_cap_reached, config["configurable"].get("thread_id")):
+            SPEND_CAP_REFUSALS.inc()
+            return {"task": "", "messages": [AIMessage(content="This conversation has reached its spending limit, so I "
+                                                               "can't plan a new itinerary here. Please start a new session.")]}
         return {"task": response.content, "messages": [AIMessage(content="I am preparing your itinerary...\n\n")]}
-    elif "Refine:" in response.content:
+    elif marker == "Refine:":
         return {"task": response.content, "messages": [AIMessage(content="I am researching your request...\n\n")]}
 
-    return {"messages": [response]}
+    # Resetting the task keeps a flow that was cancelled mid-run from being routed again.
+    update = {"task": "", "messages": [response]}
+    # A directly refined itinerary becomes the one later CURRENT refines work on;
+    # a single "Day N" line in a chat answer does not count as an itinerary.
+    if len(days := split_days(response.content)) >= 2:
+        update["itinerary"] = days
+    return update
 
 
 def determine_flow(state: AgentState) -> Literal["plan", "refine", "assistant"]:
 
-    task = state.get("task", "")
+    marker = routing_marker(state.get("task", ""))
 
-    if re.search(r"Plan:", task):
-        return "plan"
-    elif re.search(r"Refine:", task):
-        return "refine"
+    if marker == "Plan:":
+        flow = "plan"
+    elif marker == "Refine:":
+        flow = "refine"
     else:
-        return "assistant"
+        flow = "assistant"
+
+    FLOWS.labels(flow).inc()
+    return flow
 
 
-def destination_planner_node(state: AgentState) -> Dict[str, str]:
+async def destination_planner_node(state: AgentState) -> Dict[str, str]:
 
     messages = [SystemMessage(content=destination_planner_prompt),
                 HumanMessage(content=state['task'])]
 
-    response = model.invoke(messages)
+    response = await model_for("destination_planner").ainvoke(messages)
 
-    return {"basic_plan": response.content}
+    # The advisors and the planner will search for these; start them now.
+    if plan := parse_plan(response.content):
+        prefetch(transport_queries(plan) + accommodation_queries(plan) + attraction_queries(plan))
 
+    return {"basic_plan": response.content}
 
-def transport_advisor_node(state: AgentState) -> Dict[str, List[List[str]]]:
 
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=transport_advisor_prompt),
-        HumanMessage(content=f"{state['basic_plan']}")
+async def llm_queries(node: str, prompt: str, content: str) -> List[str]:
+    queries = await model_for(node).with_structured_output(Queries).ainvoke([
+        SystemMessage(content=prompt),
+        HumanMessage(content=content)
     ])
+    return queries.queries
+
+
+async def streamed_search(node: str, prompt: str, content: str, budget: SearchBudget,
+                          index: Optional[VectorIndex] = None) -> Tuple[Dict[str, str], bool]:
+    # Streams the Queries tool call and sends every query to search as soon as
+    # the model has moved on to the next one, so generation and search overlap.
+    # Returns the results and whether queries were dropped to fit the budget.
+    model = model_for(node).bind_tools([Queries], tool_choice=Queries.__name__)
+    searches: Dict[str, asyncio.Task] = {}
+    emitted: List[str] = []
+    args = ""
+
+    def dispatch(queries: List[str]) -> None:
+        for query in queries:
+            if query in searches or (budget.max_queries is not None and len(searches) >= budget.max_queries):
+                continue
+            searches[query] = asyncio.create_task(
+                search_multiple_queries([query], budget.timeout, cache_only=budget.mode == "cache_only", index=index))
+
+    try:
+        async for chunk in model.astream([SystemMessage(content=prompt), HumanMessage(content=content)]):
+            args += "".join(tool_chunk.get("args") or "" for tool_chunk in chunk.tool_call_chunks)
+            try:
+                queries = (parse_partial_json(args) or {}).get("queries") if args else None
+            except json.JSONDecodeError:
+                continue
+            if isinstance(queries, list):
+                emitted = [query for query in queries if isinstance(query, str) and query.strip()]
+                dispatch(emitted[:-1])
+        dispatch(emitted)
+
+        results: Dict[str, str] = {}
+        for task in searches.values():
+            results.update(await task)
+        return results, len(set(emitted)) > len(searches)
+    finally:
+        for task in searches.values():
+            task.cancel()
+
+
+async def template_queries(node: str, prompt: str, content: str,
+                           template: Optional[Callable[[ParsedPlan], List[str]]] = None) -> Optional[List[str]]:
+    # Queries are built from the parsed plan when possible, saving an LLM
+    # round-trip; None means the LLM has to generate them.
+    mode = QUERY_GENERATION_CONFIG["mode"]
+    plan = parse_plan(content) if template is not None and mode != "llm" else None
+    if plan is None:
+        QUERY_GENERATION.labels(node, "fallback" if template is not None and mode != "llm" else "llm").inc()
+        return None
+
+    queries = template(plan)
+    QUERY_GENERATION.labels(node, "template").inc()
+    if mode == "compare":
+        reference = await llm_queries(node, prompt, content)
+        overlap = query_overlap(queries, reference)
+        QUERY_OVERLAP.labels(node).observe(overlap)
+        logger.info("%s queries (overlap %.2f)\ntemplate: %s\nllm: %s", node, overlap, queries, reference)
+    return queries
+
+
+async def budgeted_search(node: str, prompt: str, content: str, config: RunnableConfig,
+                          template: Optional[Callable[[ParsedPlan], List[str]]] = None,
+                          index: Optional[VectorIndex] = None) -> Dict[str, Any]:
+    # Fewer queries, cached answers only, or no search at all as the
+    # remaining budget shrinks; the planner then relies on what it knows.
+    budget = search_budget(config)
+    if budget.mode == "skip":
+        return {"results": {}, "degradations": [degradation(node, "search_skipped", config)]}
+
+    queries = await template_queries(node, prompt, content, template)
+    if queries is None and QUERY_GENERATION_CONFIG["stream"]:
+        search, reduced = await streamed_search(node, prompt, content, budget, index)
+    else:
+        queries = queries if queries is not None else await llm_queries(node, prompt, content)
+        reduced = budget.max_queries is not None and len(queries) > budget.max_queries
+        queries = queries[:budget.max_queries]
+        search = await search_multiple_queries(queries, budget.timeout, cache_only=budget.mode == "cache_only",
+                                               index=index)
 
-    transport_search = run_search_multiple_queries(queries.queries)
-    
-    return {"search": [transport_search]}
+    degradations = []
+    if reduced:
+        degradations.append(degradation(node, "queries_reduced", config))
+    if budget.mode == "cache_only":
+        degradations.append(degradation(node, "cache_only", config))
 
-def accommodation_advisor_node(state: AgentState) -> Dict[str, List[List[str]]]:
+    return {"results": search, "degradations": degradations}
 
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=accommodation_advisor_prompt),
-        HumanMessage(content=f"{state['basic_plan']}")
-    ])
 
-    accommodation_search = run_search_multiple_queries(queries.queries)
-        
-    return {"search": [accommodation_search]}
+async def transport_advisor_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
+
+    result = await budgeted_search("transport_advisor", transport_advisor_prompt, f"{state['basic_plan']}", config,
+                                   transport_queries)
+    
+    return {"search": [result["results"]], "degradations": result["degradations"]}
 
+async def accommodation_advisor_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
 
-def itinerary_planner_node(state: AgentState) -> Dict[str, Any]:
+    result = await budgeted_search("accommodation_advisor", accommodation_advisor_prompt, f"{state['basic_plan']}",
+                                   config, accommodation_queries)
+        
+    return {"search": [result["results"]], "degradations": result["degradations"]}
 
+
+async def write_segment(basic_plan: str, segment: Segment, batches: List[Dict[str, str]],
+                        writer: Optional[StreamWriter] = None) -> str:
+    context = build_context("itinerary_segment", segment_results(batches, segment), f"{segment.city} {basic_plan}")
+    days = f"Day {segment.first_day}" if segment.first_day == segment.last_day else \
+        f"Days {segment.first_day}-{segment.last_day}"
+    messages = [
+        SystemMessage(content=itinerary_segment_prompt),
+        HumanMessage(content=f"""{basic_plan}
+                     \n\nWrite {days} in {segment.city}, {segment.country}, covering: {', '.join(segment.places)}.
+                     Arriving from {segment.previous_stop}, continuing to {segment.next_stop}.
+                     \n\nHere is the accommodation and ticket info:\n\n{context}""")]
+    model = model_for("itinerary_planner").with_config(tags=[TAG_NOSTREAM])
+    if writer is None:
+        return (await model.ainvoke(messages)).content
+
+    # Streamed on the custom stream, where the later segments follow it in order.
+    text = []
+    async for chunk in model.astream(messages):
+        if isinstance(chunk.content, str) and chunk.content:
+            writer({"node": "itinerary_planner", "text": chunk.content})
+            text.append(chunk.content)
+    return "".join(text)
+
+
+async def map_reduce_itinerary(basic_plan: str, segments: List[Segment], batches: List[Dict[str, str]],
+                               config: RunnableConfig, writer: StreamWriter) -> Tuple[AIMessage, str, List[Dict[str, Any]]]:
+    # Cities are written concurrently, so wall-clock time follows the longest
+    # segment. The first segment streams its tokens; the others would arrive
+    # interleaved, so each is sent whole, in day order, as soon as it and the
+    # ones before it are done. A short pass then adds a closing summary and
+    # flags conflicts.
+    tasks = [asyncio.create_task(write_segment(basic_plan, segment, batches, None if i else writer))
+             for i, segment in enumerate(segments)]
+    parts: List[str] = []
+
+    async def write_in_order() -> None:
+        for task in tasks:
+            part = await task
+            # The first segment is kept as streamed so the message matches what was sent.
+            if parts:
+                part = part.strip()
+                writer({"node": "itinerary_planner", "text": f"\n\n{part}"})
+            parts.append(part)
+
+    try:
+        await within_budget(write_in_order(), config)
+    finally:
+        for task in tasks:
+            task.cancel()
+    itinerary = "\n\n".join(parts)
+
+    # The itinerary is complete without the closing summary, so running out of
+    # time here only drops the summary.
+    try:
+        review = await within_budget(model_for("itinerary_stitcher").with_config(tags=[TAG_NOSTREAM]).ainvoke([
+            SystemMessage(content=itinerary_stitch_prompt),
+            HumanMessage(content=f"{basic_plan}\n\nItinerary:\n\n{itinerary}")]), config)
+    except asyncio.TimeoutError:
+        return AIMessage(content=itinerary), itinerary, [degradation("itinerary_planner", "summary_skipped", config)]
+    closing = review.content.strip()
+    if closing:
+        writer({"node": "itinerary_planner", "text": f"\n\n{closing}"})
+    return AIMessage(content="\n\n".join(part for part in (itinerary, closing) if part)), itinerary, []
+
+
+OUT_OF_TIME = "\n\nSorry, I ran out of time for this request. Please try again, or allow more time."
+
+
+def out_of_time(node: str, config: RunnableConfig) -> Dict[str, Any]:
+    # The stored itinerary is kept, since the new one was cut short.
+    return {"messages": [AIMessage(content=OUT_OF_TIME.strip())], "task": "",
+            "degradations": [degradation(node, "out_of_time", config)]}
+
+
+async def itinerary_planner_node(state: AgentState, config: RunnableConfig, writer: StreamWriter) -> Dict[str, Any]:
+
+    # Attraction details are only used if the prefetch already has them.
+    plan = parse_plan(state['basic_plan'])
+    attractions = await search_multiple_queries(attraction_queries(plan), cache_only=True) if plan else {}
+    batches = state['search'][-2:] + [attractions]
+
+    if segments := plan_segments(plan):
+        try:
+            response, itinerary, degradations = await map_reduce_itinerary(state['basic_plan'], segments, batches,
+                                                                           config, writer)
+        except asyncio.TimeoutError:
+            # Segments already went out on the custom stream, so the note does too.
+            writer({"node": "itinerary_planner", "text": OUT_OF_TIME})
+            return out_of_time("itinerary_planner", config)
+        return {"messages": [response], "itinerary": split_days(itinerary), "task": "", "degradations": degradations}
+
+    context = build_context("itinerary_planner", batches, state['basic_plan'])
     messages = [
         SystemMessage(content=itinerary_planner_prompt),
         HumanMessage(content=f"""{state['basic_plan']}
-                     \n\nHere is the accommodation and ticket info:\n\n{state['search'][-2:]}""")]
+                     \n\nHere is the accommodation and ticket info:\n\n{context}""")]
     
-    response = model.invoke(messages)
-    return {"messages": [response], "task": ""}
-
-def itinerary_researcher_node(state: AgentState) -> Dict[str, List[List[str]]]:
-
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=itinerary_researcher_prompt),
-        HumanMessage(content=state['task'])
-    ])
-
-    research = run_search_multiple_queries(queries.queries)
-
-    return {"research": [research]}
-
-def itinerary_optimizer_node(state: AgentState) -> Dict[str, Any]:
-
+    try:
+        response = await within_budget(model_for("itinerary_planner").ainvoke(messages), config)
+    except asyncio.TimeoutError:
+        return out_of_time("itinerary_planner", config)
+    return {"messages": [response], "itinerary": split_days(response.content), "task": ""}
+
+def previous_reply(messages: List[Any]) -> str:
+    human = max((i for i, message in enumerate(messages) if message.type == "human"), default=len(messages))
+    return next((message.content for message in reversed(messages[:human])
+                 if message.type == "ai" and isinstance(message.content, str) and message.content.strip()), "")
+
+
+def refine_task(state: AgentState) -> str:
+    # The Refine: task, with a CURRENT itinerary that has no stored day blocks
+    # replaced by the reply the traveler answered to.
+    request, pasted = parse_refine(state['task'])
+    if pasted.upper() != "CURRENT" or state.get('itinerary'):
+        return state['task']
+    return f"Refine:\nTraveler's Request: {request}\nItinerary: {previous_reply(state['messages'])}"
+
+
+def refine_target(state: AgentState) -> Tuple[str, List[Dict[str, Any]], List[int]]:
+    # The request, the itinerary as day blocks (pasted in the task, else the
+    # stored one) and the indexes of the blocks the request touches.
+    request, pasted = parse_refine(refine_task(state))
+    blocks = split_days(pasted) or state.get('itinerary') or []
+    return request, blocks, affected_days(blocks, request) if blocks else []
+
+
+async def itinerary_researcher_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
+
+    request, blocks, affected = refine_target(state)
+    content = f"Traveler's Request: {request}\n\nItinerary:\n{render_days([blocks[i] for i in affected])}" \
+        if blocks else refine_task(state)
+    # Answers from this thread's earlier searches and refines stand in for
+    # web searches on similar queries.
+    index = VectorIndex.from_batches(state.get('search', []) + state.get('research', []))
+    result = await budgeted_search("itinerary_researcher", itinerary_researcher_prompt, content, config,
+                                   index=index)
+
+    return {"research": [result["results"]], "degradations": result["degradations"]}
+
+async def itinerary_optimizer_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
+
+    request, blocks, affected = refine_target(state)
+    context = build_context("itinerary_optimizer", state['research'][-1:], request)
+
+    if blocks and len(affected) < len(blocks):
+        # Only the affected days are regenerated; the rest is merged back in.
+        days = [blocks[i] for i in affected]
+        outline = "\n".join(block["text"].splitlines()[0] for i, block in enumerate(blocks)
+                            if i not in affected and block["label"])
+        try:
+            response = await within_budget(model_for("itinerary_optimizer").with_config(tags=[TAG_NOSTREAM]).ainvoke([
+                SystemMessage(content=itinerary_days_optimizer_prompt),
+                HumanMessage(content=f"""Traveler's Request: {request}
+                             \n\nRest of the itinerary (unchanged):\n{outline}
+                             \n\nDays to update:\n\n{render_days(days)}
+                             \n\nHere is the research info:\n\n{context}""")]), config)
+        except asyncio.TimeoutError:
+            return out_of_time("itinerary_optimizer", config)
+        updated, _, changes = response.content.partition("Changes:")
+        labels = {block["label"] for block in days}
+        if patch := [block for block in split_days(updated) if block["label"] in labels]:
+            REFINES.labels("patch").inc()
+            merged = merge_days(blocks, patch)
+            content = render_days(merged) + (f"\n\nChanges: {changes.strip()}" if changes.strip() else "")
+            return {"messages": [AIMessage(content=content)], "itinerary": merged, "itinerary_patch": patch, "task": ""}
+
+    REFINES.labels("full").inc()
+    task = f"Traveler's Request: {request}\nItinerary: {render_days(blocks)}" if blocks else refine_task(state)
     messages = [
         SystemMessage(content=itinerary_optimizer_prompt),
-        HumanMessage(content=f"""{state['task']}
-                     \n\nHere is the research info:\n\n{state['research']}""")
+        HumanMessage(content=f"""{task}
+                     \n\nHere is the research info:\n\n{context}""")
     ]
-    response = model.invoke(messages)
-    return {"messages": [response], "task": ""}
\ No newline at end of file
+    try:
+        response = await within_budget(model_for("itinerary_optimizer").ainvoke(messages), config)
+    except asyncio.TimeoutError:
+        return out_of_time("itinerary_optimizer", config)
+    return {"messages": [response], "itinerary": split_days(response.content), "task": ""}
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_GENERATION_CONFIG = {
+    # template: build queries from the parsed plan, LLM only if parsing fails
+    # llm: always ask the LLM
+    # compare: use the template queries but also ask the LLM and record the overlap
+    "mode": os.getenv("QUERY_GENERATION", "template"),
+    "max_queries": int(os.getenv("TEMPLATE_MAX_QUERIES", "8")),
+    # stream the LLM's Queries tool call and start searching query by query
+    "stream": os.getenv("STREAM_QUERIES", "on") == "on",
+}
+
+# "Name: value" lines, also as markdown bullets, headings or in bold.
+FIELD_PREFIX = r"^[\s>*_#-]*{}[\s*_]*:[\s*_]*"
+FIELD_PATTERN = FIELD_PREFIX + r"(.+)$"
+
+
+class ParsedPlan(NamedTuple):
+    departure: str
+    destinations: Dict[str, Dict[str, List[str]]]
+    time: str
+    duration: Optional[str] = None
+
+
+def _tokens(text: str) -> List[str]:
+    return [token.strip() for token in re.findall(r"[{}\[\]:,]|[^{}\[\]:,]+", text) if token.strip()]
+
+
+def _parse_value(tokens: List[str], i: int) -> Tuple[Any, int]:
+    # Parses the pseudo-JSON of the Destinations line: bare or quoted strings,
+    # {key: value} objects and [item] lists.
+    if tokens[i] == "{":
+        value, i = {}, i + 1
+        while tokens[i] != "}":
+            key = tokens[i].strip("\"'")
+            if tokens[i + 1] != ":":
+                raise ValueError(f"Expected ':' after {key}")
+            value[key], i = _parse_value(tokens, i + 2)
+            if tokens[i] == ",":
+                i += 1
+        return value, i + 1
+    if tokens[i] == "[":
+        items, i = [], i + 1
+        while tokens[i] != "]":
+            item, i = _parse_value(tokens, i)
+            items.append(item)
+            if tokens[i] == ",":
+                i += 1
+        return items, i + 1
+    if tokens[i] in "}]:,":
+        raise ValueError(f"Unexpected {tokens[i]}")
+    return tokens[i].strip("\"'"), i + 1
+
+
+def _field(text: str, name: str) -> Optional[str]:
+    match = re.search(FIELD_PATTERN.format(name), text, re.MULTILINE | re.IGNORECASE)
+    return match.group(1).strip(" *_") if match else None
+
+
+def parse_plan(text: str) -> Optional[ParsedPlan]:
+    departure, time = _field(text, "Departure Location"), _field(text, "Time")
+    start = re.search(FIELD_PREFIX.format("Destinations"), text, re.MULTILINE | re.IGNORECASE)
+    if not departure or not time or not start:
+        return None
+
+    try:
+        destinations, _ = _parse_value(_tokens(text[start.end():]), 0)
+    except (IndexError, ValueError):
+        return None
+
+    if not isinstance(destinations, dict) or not destinations or \
+            not all(isinstance(cities, dict) and cities for cities in destinations.values()):
+        return None
+    return ParsedPlan(departure, destinations, time, _field(text, "Duration"))
+
+
+def _stops(plan: ParsedPlan) -> List[Tuple[str, str]]:
+    return [(city, country) for country, cities in plan.destinations.items() for city in cities]
+
+
+def transport_queries(plan: ParsedPlan) -> List[str]:
+    stops = _stops(plan)
+    queries = [f"cheapest flights from {plan.departure} to {stops[0][0]} {plan.time}"]
+    for (origin, origin_country), (destination, destination_country) in zip(stops, stops[1:]):
+        mode = "train or bus tickets" if origin_country == destination_country else "cheapest flights"
+        queries.append(f"{mode} from {origin} to {destination} {plan.time}")
+    queries.append(f"cheapest flights from {stops[-1][0]} to {plan.departure} {plan.time}")
+    return queries[:QUERY_GENERATION_CONFIG["max_queries"]]
+
+
+def accommodation_queries(plan: ParsedPlan) -> List[str]:
+    queries = []
+    for country, cities in plan.destinations.items():
+        for city, places in cities.items():
+            queries.append(f"best value hotels in {city}, {country} {plan.time}")
+            if isinstance(places, list) and places:
+                queries.append(f"best area to stay in {city} near {', '.join(map(str, places[:3]))}")
+    return queries[:QUERY_GENERATION_CONFIG["max_queries"]]
+
+
+def attraction_queries(plan: ParsedPlan) -> List[str]:
+    queries = []
+    for country, cities in plan.destinations.items():
+        for city, places in cities.items():
+            for place in places if isinstance(places, list) else []:
+                queries.append(f"{place} {city} opening hours and ticket prices")
+    return queries[:QUERY_GENERATION_CONFIG["max_queries"]]
+
+
+def query_overlap(first: List[str], second: List[str]) -> float:
+    words = [set(re.findall(r"\w+", " ".join(queries).lower())) for queries in (first, second)]
+    union = words[0] | words[1]
+    return len(words[0] & words[1]) / len(union) if union else 1.0
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, TypeVar
+import httpx
+import openai
+from dotenv import load_dotenv
+from my_agent.utils.metrics import RESILIENCE_EVENTS
+
+load_dotenv()
+
+T = TypeVar("T")
+
+RESILIENCE_CONFIG = {
+    "retry_attempts": int(os.getenv("RETRY_ATTEMPTS", "3")),
+    "retry_base_delay_seconds": float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5")),
+    "retry_max_delay_seconds": float(os.getenv("RETRY_MAX_DELAY_SECONDS", "8")),
+    "hedge_search": os.getenv("HEDGE_SEARCH", "on") == "on",
+    "hedge_llm": os.getenv("HEDGE_LLM", "off") == "on",
+    "hedge_quantile": float(os.getenv("HEDGE_QUANTILE", "0.95")),
+    "hedge_min_samples": int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+    "hedge_default_delay_seconds": float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "3")),
+    "breaker_failure_threshold": int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+    "breaker_reset_seconds": float(os.getenv("BREAKER_RESET_SECONDS", "30")),
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, openai.APIConnectionError,
+                              openai.RateLimitError, openai.InternalServerError))
+
+
+class LatencyTracker:
+    # Rolling window of successful call latencies used to pick the hedge delay.
+
+    def __init__(self, window: int = 200):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self) -> float:
+        with self.lock:
+            if len(self.samples) < RESILIENCE_CONFIG["hedge_min_samples"]:
+                return RESILIENCE_CONFIG["hedge_default_delay_seconds"]
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * RESILIENCE_CONFIG["hedge_quantile"]))]
+
+
+class CircuitBreaker:
+    # Opens after consecutive failures; after the reset timeout one trial call
+    # is let through (half-open) and its outcome closes or re-opens the circuit.
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def enter(self) -> Optional[bool]:
+        # None if the call is rejected, True if it is the half-open trial.
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.reset_seconds and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return None
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    RESILIENCE_EVENTS.labels(self.name, "breaker_open").inc()
+                self.opened_at = time.monotonic()
+
+    def record_error(self, error: BaseException, trial: bool) -> None:
+        # Only retryable errors count against the service; any other error is
+        # still an answer from it. A cancelled trial gives up its slot so the
+        # next call becomes the trial.
+        if is_retryable(error):
+            self.record_failure()
+        elif isinstance(error, Exception):
+            self.record_success()
+        elif trial:
+            with self.lock:
+                self.trial_in_flight = False
+
+
+async def hedged(call: Callable[[], Awaitable[T]], delay: float, target: str) -> T:
+    # Starts a duplicate call if the first one has not finished after `delay`
+    # and returns whichever succeeds first.
+    first = asyncio.ensure_future(call())
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+
+        RESILIENCE_EVENTS.labels(target, "hedge").inc()
+        second = asyncio.ensure_future(call())
+        pending.add(second)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        RESILIENCE_EVENTS.labels(target, "hedge_win").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller is cancelled, so no attempt outlives it.
+        for task in pending:
+            task.cancel()
+
+
+async def with_retries(call: Callable[[], Awaitable[T]], target: str) -> T:
+    attempts = RESILIENCE_CONFIG["retry_attempts"]
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except Exception as error:
+            if attempt == attempts - 1 or not is_retryable(error):
+                raise
+            RESILIENCE_EVENTS.labels(target, "retry").inc()
+            await asyncio.sleep(backoff_delay(attempt))
+
+
+def backoff_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter.
+    ceiling = min(RESILIENCE_CONFIG["retry_max_delay_seconds"],
+                  RESILIENCE_CONFIG["retry_base_delay_seconds"] * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+async def resilient_call(call: Callable[[], Awaitable[T]], target: str, tracker: LatencyTracker,
+                         hedge: bool, breaker: Optional[CircuitBreaker] = None) -> T:
+    trial = breaker.enter() if breaker is not None else False
+    if trial is None:
+        RESILIENCE_EVENTS.labels(target, "breaker_rejected").inc()
+        raise CircuitOpenError(f"{target} circuit is open")
+
+    async def timed_call() -> T:
+        started = time.perf_counter()
+        result = await call()
+        tracker.record(time.perf_counter() - started)
+        return result
+
+    async def attempt() -> T:
+        if hedge:
+            return await hedged(timed_call, tracker.hedge_delay(), target)
+        return await timed_call()
+
+    try:
+        result = await with_retries(attempt, target)
+    except BaseException as error:
+        if breaker is not None:
+            breaker.record_error(error, trial)
+        raise
+    if breaker is not None:
+        breaker.record_success()
+    return result
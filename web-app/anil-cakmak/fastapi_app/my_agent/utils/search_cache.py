@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from my_agent.utils.kvstore import SqliteTTLStore
+from my_agent.utils.metrics import SEARCH_CACHE_REQUESTS
+
+load_dotenv()
+
+SEARCH_CACHE_CONFIG = {
+    "enabled": os.getenv("SEARCH_CACHE", "on") == "on",
+    "path": os.getenv("SEARCH_CACHE_DB_PATH", "search_cache.sqlite"),
+    "stale_grace_seconds": float(os.getenv("SEARCH_CACHE_STALE_GRACE_SECONDS", str(7 * 24 * 3600))),
+}
+
+# First matching class wins; prices and availability go stale quickly,
+# descriptions of places hardly change.
+QUERY_CLASSES = [
+    ("prices", re.compile(r"\b(price|prices|cost|costs|cheap|cheapest|budget|fare|fares|ticket|tickets|flight|flights|"
+                          r"deal|deals|book|booking|availability|rate|rates)\b"),
+     float(os.getenv("SEARCH_CACHE_PRICES_TTL_SECONDS", str(6 * 3600)))),
+    ("schedules", re.compile(r"\b(schedule|schedules|timetable|opening hours|open|weather|event|events|festival|"
+                             r"train|trains|bus|buses|ferry|ferries)\b"),
+     float(os.getenv("SEARCH_CACHE_SCHEDULES_TTL_SECONDS", str(24 * 3600)))),
+    ("accommodation", re.compile(r"\b(hotel|hotels|hostel|hostels|accommodation|stay|airbnb|apartment)\b"),
+     float(os.getenv("SEARCH_CACHE_ACCOMMODATION_TTL_SECONDS", str(3 * 24 * 3600)))),
+]
+DEFAULT_QUERY_CLASS = ("attractions", float(os.getenv("SEARCH_CACHE_ATTRACTIONS_TTL_SECONDS", str(30 * 24 * 3600))))
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s:/-]", " ", query.lower())).strip()
+
+
+def query_class(query: str) -> tuple:
+    normalized = normalize_query(query)
+    for name, pattern, ttl_seconds in QUERY_CLASSES:
+        if pattern.search(normalized):
+            return name, ttl_seconds
+    return DEFAULT_QUERY_CLASS
+
+
+class SearchCache:
+
+    def __init__(self, store: SqliteTTLStore, search_params: Dict[str, Any]):
+        self.store = store
+        self.params = json.dumps(search_params, sort_keys=True)
+
+    def key(self, query: str) -> str:
+        return hashlib.sha256(f"{self.params}\x00{normalize_query(query)}".encode()).hexdigest()
+
+    def get(self, query: str) -> Optional[str]:
+        raw = self.store.get(self.key(query))
+        SEARCH_CACHE_REQUESTS.labels(query_class(query)[0], "miss" if raw is None else "hit").inc()
+        return None if raw is None else json.loads(raw)
+
+    def get_many(self, queries: List[str]) -> Dict[str, str]:
+        return {query: answer for query in queries if (answer := self.get(query)) is not None}
+
+    def get_stale_many(self, queries: List[str]) -> Dict[str, str]:
+        # Expired answers are still better than nothing while Tavily is down.
+        stale = {}
+        for query in queries:
+            if (raw := self.store.get(self.key(query), allow_stale=True)) is not None:
+                stale[query] = json.loads(raw)
+        return stale
+
+    def set_many(self, answers: Dict[str, str]) -> None:
+        for query, answer in answers.items():
+            self.store.set(self.key(query), json.dumps(answer).encode(), query_class(query)[1])
+
+
+def build_search_cache(search_params: Dict[str, Any]) -> Optional[SearchCache]:
+    if not SEARCH_CACHE_CONFIG["enabled"]:
+        return None
+    return SearchCache(SqliteTTLStore(SEARCH_CACHE_CONFIG["path"], "search_cache",
+                                      stale_grace_seconds=SEARCH_CACHE_CONFIG["stale_grace_seconds"]), search_params)
@@ -1,11 +1,34 @@
-import operator
-from typing import TypedDict, Annotated
+import os
+from typing import Callable, TypedDict, Annotated
+from dotenv import load_dotenv
 from langchain_core.messages import AnyMessage
+from langgraph.graph.message import add_messages
+
+load_dotenv()
+
+STATE_CONFIG = {
+    "search_window": int(os.getenv("STATE_SEARCH_WINDOW", "2")),
+    # research batches of earlier refines, reused through the local index
+    "research_window": int(os.getenv("STATE_RESEARCH_WINDOW", "4")),
+    "message_window": int(os.getenv("STATE_MESSAGE_WINDOW", "6")),
+    "summary_token_threshold": int(os.getenv("STATE_SUMMARY_TOKEN_THRESHOLD", "3000")),
+    "degradation_window": int(os.getenv("STATE_DEGRADATION_WINDOW", "10")),
+}
+
+
+def keep_latest(window: int) -> Callable[[list, list], list]:
+    def reducer(left: list, right: list) -> list:
+        return (left + right)[-window:]
+    return reducer
 
 
 class AgentState(TypedDict):
-    messages: Annotated[list[AnyMessage], operator.add]
+    messages: Annotated[list[AnyMessage], add_messages]
+    summary: str
     task: str
     basic_plan: str
-    search: Annotated[list, operator.add]
-    research: list
\ No newline at end of file
+    search: Annotated[list, keep_latest(STATE_CONFIG["search_window"])]
+    research: Annotated[list, keep_latest(STATE_CONFIG["research_window"])]
+    itinerary: list
+    itinerary_patch: list
+    degradations: Annotated[list, keep_latest(STATE_CONFIG["degradation_window"])]
\ No newline at end of file
@@ -1,50 +1,232 @@
 import asyncio
 import os
-from tavily import TavilyClient
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import httpx
 from dotenv import load_dotenv
-from typing import Dict, List
+from typing import Any, Coroutine, Dict, List, Optional
 from pydantic import BaseModel
+from my_agent.utils.metrics import (PREFETCH_QUERIES, RESILIENCE_EVENTS, SEARCH_ERRORS, SEARCH_LATENCY,
+                                   SEARCH_QUERIES)
+from my_agent.utils.search_cache import build_search_cache, normalize_query
+from my_agent.utils.limits import tavily_limiter
+from my_agent.utils.resilience import RESILIENCE_CONFIG, CircuitBreaker, LatencyTracker, resilient_call
+from my_agent.utils.vector_index import VectorIndex, global_index, local_answers
 
 load_dotenv()
 
-tavily = TavilyClient(os.getenv("TAVILY_API_KEY"))
+SEARCH_CLIENT_CONFIG = {
+    "api_key": os.getenv("TAVILY_API_KEY"),
+    "base_url": os.getenv("TAVILY_BASE_URL", "https://api.tavily.com"),
+    "max_connections": int(os.getenv("SEARCH_MAX_CONNECTIONS", "20")),
+    "timeout_seconds": float(os.getenv("SEARCH_TIMEOUT_SECONDS", "15")),
+    "keepalive_seconds": float(os.getenv("SEARCH_KEEPALIVE_SECONDS", "60")),
+}
+
+PREFETCH_CONFIG = {
+    "enabled": os.getenv("PREFETCH", "on") == "on",
+    "max_queries": int(os.getenv("PREFETCH_MAX_QUERIES", "16")),
+    "max_in_flight": int(os.getenv("PREFETCH_MAX_IN_FLIGHT", "24")),
+}
+
+SEARCH_PARAMS = {
+    "search_depth": "basic",
+    "max_results": 2,
+    "include_answer": True
+}
+
+search_cache = build_search_cache(SEARCH_PARAMS)
 
 class Queries(BaseModel):
     queries: List[str]
 
 
-async def search_single_query(query: str) -> Dict:
-    loop = asyncio.get_running_loop()
-    response = await loop.run_in_executor(
-        None,
-        lambda: tavily.search(
-            query=query,
-            search_depth="basic",
-            max_results=2,
-            include_answer=True
-        )
-    )
-    return response
+class SearchClient:
+    # Long-lived Tavily client. httpx connection pools are bound to an event
+    # loop, so one pool is kept per loop that uses the client. Concurrency and
+    # request rate are governed by the shared tavily limiter.
+
+    def __init__(self, api_key: Optional[str], base_url: str, max_connections: int,
+                 timeout_seconds: float, keepalive_seconds: float):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout_seconds = timeout_seconds
+        self.keepalive_seconds = keepalive_seconds
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if (client := self._clients.get(loop)) is None:
+            client = self._clients[loop] = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"},
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=self.keepalive_seconds),
+                timeout=self.timeout_seconds,
+            )
+        return client
+
+    async def search(self, query: str, timeout: Optional[float] = None) -> Dict:
+        client = self._client()
+        async with tavily_limiter().acquire():
+            started = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/search", json={"query": query, **SEARCH_PARAMS},
+                    timeout=min(timeout, self.timeout_seconds) if timeout else self.timeout_seconds
+                )
+                response.raise_for_status()
+                return response.json()
+            finally:
+                SEARCH_LATENCY.observe(time.perf_counter() - started)
+
+    async def aclose(self) -> None:
+        loop = asyncio.get_running_loop()
+        if (client := self._clients.pop(loop, None)) is not None:
+            await client.aclose()
+
+
+search_client = SearchClient(**SEARCH_CLIENT_CONFIG)
+search_latency = LatencyTracker()
+search_breaker = CircuitBreaker("tavily", RESILIENCE_CONFIG["breaker_failure_threshold"],
+                                RESILIENCE_CONFIG["breaker_reset_seconds"])
+
+
+_flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, list]]" = weakref.WeakKeyDictionary()
+
+
+def _loop_flights() -> Dict[str, list]:
+    return _flights.setdefault(asyncio.get_running_loop(), {})
+
+
+async def search_single_query(query: str, timeout: Optional[float] = None) -> Dict:
+    # Single flight: concurrent searches for the same normalized query share one
+    # Tavily call, which is cancelled only once every caller has gone away.
+    flights, key = _loop_flights(), normalize_query(query)
+    if (flight := flights.get(key)) is None:
+        task = asyncio.ensure_future(resilient_call(lambda: search_client.search(query, timeout), "tavily",
+                                                    search_latency, RESILIENCE_CONFIG["hedge_search"], search_breaker))
+        flight = flights[key] = [task, 0]
+        task.add_done_callback(lambda _: flights.pop(key) if flights.get(key) is flight else None)
+
+    flight[1] += 1
+    try:
+        return await asyncio.shield(flight[0])
+    finally:
+        flight[1] -= 1
+        if not flight[1]:
+            flight[0].cancel()
+
+
+# Queries fetched speculatively and not yet asked for by a node (bounded),
+# and the running prefetch batches with their query counts.
+MAX_TRACKED_PREFETCHES = 4096
+_prefetched: "OrderedDict[str, None]" = OrderedDict()
+_prefetch_batches: Dict[asyncio.Task, int] = {}
+
+
+def _count_prefetch_hits(queries: List[str], available: Dict[str, str]) -> None:
+    flights = _loop_flights()
+    for query in queries:
+        key = normalize_query(query)
+        if key in _prefetched:
+            del _prefetched[key]
+            if query in available or key in flights:
+                PREFETCH_QUERIES.labels("hit").inc()
+
 
+def prefetch(queries: List[str]) -> None:
+    # Fires likely searches in the background so later node searches become
+    # cache hits or join the in-flight call. Capped per call and overall.
+    if not PREFETCH_CONFIG["enabled"] or search_cache is None:
+        return
+    queries = list(dict.fromkeys(queries))
+    room = max(0, PREFETCH_CONFIG["max_in_flight"] - sum(_prefetch_batches.values()))
+    batch = queries[:min(PREFETCH_CONFIG["max_queries"], room)]
+    if len(queries) > len(batch):
+        PREFETCH_QUERIES.labels("dropped").inc(len(queries) - len(batch))
+    if not batch:
+        return
 
-async def search_multiple_queries(queries: List[str]) -> Dict[str, str]:
-    tasks = [search_single_query(query) for query in queries]
+    task = asyncio.create_task(search_multiple_queries(batch, prefetch=True))
+    _prefetch_batches[task] = len(batch)
+    task.add_done_callback(_prefetch_batches.pop)
+
+
+async def search_multiple_queries(queries: List[str], timeout: Optional[float] = None, cache_only: bool = False,
+                                  prefetch: bool = False, index: Optional[VectorIndex] = None) -> Dict[str, str]:
+    # Exact cache hits first, then answers to similar past queries from the
+    # thread's `index` and the global one; only the rest go to Tavily.
+    cached = await asyncio.to_thread(search_cache.get_many, queries) if search_cache else {}
+    local = {}
+    if not prefetch:
+        _count_prefetch_hits(queries, cached)
+        local = local_answers([query for query in queries if query not in cached], index)
+        cached.update(local)
+    pending = [query for query in queries if query not in cached]
+    if not prefetch:
+        SEARCH_QUERIES.labels("cache").inc(len(cached) - len(local))
+        SEARCH_QUERIES.labels("local_index").inc(len(local))
+        SEARCH_QUERIES.labels("none" if cache_only else "web").inc(len(pending))
+    if cache_only:
+        return cached
+
+    if prefetch:
+        PREFETCH_QUERIES.labels("issued").inc(len(pending))
+        for query in pending:
+            _prefetched[normalize_query(query)] = None
+        while len(_prefetched) > MAX_TRACKED_PREFETCHES:
+            _prefetched.popitem(last=False)
+
+    # `timeout` bounds each query including its retries and hedges; every
+    # attempt keeps the client's own per-call timeout.
+    tasks = [asyncio.wait_for(search_single_query(query), timeout) if timeout else search_single_query(query)
+             for query in pending]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     
+    fresh = {}
     extracted_results = {}
-    for query, result in zip(queries, results):
+    for query, result in zip(pending, results):
         if isinstance(result, dict) and "answer" in result:
-            extracted_results[query] = result["answer"]
+            fresh[query] = result["answer"]
         else:
+            SEARCH_ERRORS.inc()
             extracted_results[query] = f"Error: {result}"
-    
-    return extracted_results
+
+    if search_cache and fresh:
+        await asyncio.to_thread(search_cache.set_many, {query: answer for query, answer in fresh.items() if answer})
+    if global_index is not None and fresh:
+        global_index.add(fresh)
+
+    if search_cache and extracted_results:
+        stale = await asyncio.to_thread(search_cache.get_stale_many, list(extracted_results))
+        if stale:
+            RESILIENCE_EVENTS.labels("tavily", "stale_fallback").inc(len(stale))
+            extracted_results.update(stale)
+
+    extracted_results.update(fresh)
+    extracted_results.update(cached)
+    return {query: extracted_results[query] for query in queries}
+
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+
+def _run_in_background_loop(coroutine: Coroutine[Any, Any, Any]) -> Any:
+    # Sync callers share one long-lived loop (and its connection pool)
+    # instead of creating a new event loop per call.
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="search-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop).result()
 
 
 def run_search_multiple_queries(queries: List[str]) -> Dict[str, str]:
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop.run_until_complete(search_multiple_queries(queries))
\ No newline at end of file
+    return _run_in_background_loop(search_multiple_queries(queries))
\ No newline at end of file
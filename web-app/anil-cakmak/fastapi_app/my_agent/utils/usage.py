@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from my_agent.utils.metrics import LLM_COST
+
+load_dotenv()
+
+USAGE_CONFIG = {
+    "path": os.getenv("USAGE_DB_PATH", "usage.sqlite"),
+    "busy_timeout_seconds": float(os.getenv("USAGE_BUSY_TIMEOUT_SECONDS", "30")),
+    # 0 disables the cap
+    "thread_spend_cap_usd": float(os.getenv("THREAD_SPEND_CAP_USD", "0")),
+}
+
+# USD per million tokens, matched by the longest model name prefix.
+MODEL_PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    **json.loads(os.getenv("MODEL_PRICES", "{}")),
+}
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prices = MODEL_PRICES[max(matches, key=len)]
+    return ((prompt_tokens - cached_tokens) * prices["input"] +
+            cached_tokens * prices.get("cached_input", prices["input"]) +
+            completion_tokens * prices["output"]) / 1_000_000
+
+
+class UsageStore:
+    # One row per model call; WAL mode so every worker process can append.
+
+    def __init__(self, path: str, busy_timeout_seconds: float = 30):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout_seconds, check_same_thread=False)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS usage (
+                thread TEXT NOT NULL,
+                request_id TEXT NOT NULL,
+                node TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                cost_usd REAL NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS usage_thread ON usage (thread, created_at);
+            """
+        )
+
+    def record(self, thread: str, request_id: str, node: str, model: str, prompt_tokens: int,
+               completion_tokens: int, cached_tokens: int, cost_usd: float) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread, request_id, node, model, prompt_tokens, completion_tokens, cached_tokens, cost_usd,
+                 time.time()),
+            )
+
+    def thread_cost(self, thread: str) -> float:
+        with self.lock:
+            row = self.conn.execute("SELECT COALESCE(SUM(cost_usd), 0) FROM usage WHERE thread = ?",
+                                    (thread,)).fetchone()
+        return row[0]
+
+    def thread_usage(self, thread: str) -> Dict[str, Any]:
+        columns = ("SUM(prompt_tokens), SUM(completion_tokens), SUM(cached_tokens), SUM(cost_usd), COUNT(*), "
+                   "MIN(created_at)")
+        with self.lock:
+            totals = self.conn.execute(f"SELECT {columns} FROM usage WHERE thread = ?", (thread,)).fetchone()
+            by_node = self.conn.execute(f"SELECT node, model, {columns} FROM usage WHERE thread = ? "
+                                        "GROUP BY node, model ORDER BY node", (thread,)).fetchall()
+            by_request = self.conn.execute(f"SELECT request_id, {columns} FROM usage WHERE thread = ? "
+                                           "GROUP BY request_id ORDER BY MIN(created_at)", (thread,)).fetchall()
+
+        def summary(row: Tuple) -> Dict[str, Any]:
+            prompt, completion, cached, cost, calls, _ = row
+            return {"prompt_tokens": prompt or 0, "completion_tokens": completion or 0,
+                    "cached_tokens": cached or 0, "cost_usd": round(cost or 0, 6), "calls": calls}
+
+        return {
+            "thread": thread,
+            "totals": summary(totals),
+            "by_node": [{"node": row[0], "model": row[1], **summary(row[2:])} for row in by_node],
+            "by_request": [{"request_id": row[0], "started_at": row[-1], **summary(row[1:])} for row in by_request],
+            "spend_cap_usd": USAGE_CONFIG["thread_spend_cap_usd"] or None,
+        }
+
+
+usage_store = UsageStore(USAGE_CONFIG["path"], USAGE_CONFIG["busy_timeout_seconds"])
+
+
+def spend_cap_reached(thread: Optional[str]) -> bool:
+    cap = USAGE_CONFIG["thread_spend_cap_usd"]
+    return bool(cap and thread and usage_store.thread_cost(thread) >= cap)
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    # Attributes every model call of one request to its thread and node. Not
+    # run inline, so the SQLite writes happen off the event loop.
+
+    def __init__(self, thread: str, request_id: str):
+        self.thread = thread
+        self.request_id = request_id
+        self.calls: Dict[UUID, Tuple[str, str]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        self.calls[run_id] = (metadata.get("langgraph_node", "unknown"), metadata.get("ls_model_name", "unknown"))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        if (call := self.calls.pop(run_id, None)) is None:
+            return
+        node, model = call
+
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                model = message.response_metadata.get("model_name", model)
+                prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+                cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+                cost = call_cost(model, prompt, completion, cached)
+                LLM_COST.labels(node, model).inc(cost)
+                usage_store.record(self.thread, self.request_id, node, model, prompt, completion, cached, cost)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.calls.pop(run_id, None)
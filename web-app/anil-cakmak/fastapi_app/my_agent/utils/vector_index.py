@@ -0,0 +1,136 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from my_agent.utils.context import STOPWORDS
+from my_agent.utils.metrics import LOCAL_INDEX_LATENCY
+from my_agent.utils.search_cache import normalize_query
+
+load_dotenv()
+
+LOCAL_INDEX_CONFIG = {
+    "enabled": os.getenv("LOCAL_INDEX", "on") == "on",
+    # also share answers across threads (process-wide, in memory)
+    "global": os.getenv("LOCAL_INDEX_GLOBAL", "off") == "on",
+    "global_max_entries": int(os.getenv("LOCAL_INDEX_GLOBAL_MAX_ENTRIES", "5000")),
+    "dimensions": int(os.getenv("LOCAL_INDEX_DIMENSIONS", "2048")),
+    # cosine similarity of the queries needed to reuse an answer
+    "min_similarity": float(os.getenv("LOCAL_INDEX_MIN_SIMILARITY", "0.9")),
+}
+
+# Words a search query can swap without asking for something else. Every other
+# non-stopword (places, dates, weekdays, numbers) is a key term that has to
+# match exactly, since hashing gives "Tokyo" no more weight than "flights".
+GENERIC_TERMS = {
+    "best", "cheap", "cheapest", "affordable", "budget", "good", "top", "popular", "recommended", "value",
+    "price", "prices", "cost", "costs", "fare", "fares", "ticket", "tickets", "flight", "flights", "deal", "deals",
+    "hotel", "hotels", "accommodation", "accommodations", "stay", "place", "places", "area", "areas", "near",
+    "opening", "hours", "open", "times", "schedule", "schedules", "info", "information", "guide", "things",
+    "what", "how", "much", "when", "where", "does", "do", "get", "find", "book", "booking", "options", "travel",
+}
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", normalize_query(text))
+
+
+def key_terms(text: str) -> FrozenSet[str]:
+    return frozenset(word for word in _words(text) if word not in STOPWORDS and word not in GENERIC_TERMS)
+
+
+def _features(text: str) -> List[str]:
+    # Words other than stopwords, plus their pairs so that "from Paris to Rome"
+    # and "from Rome to Paris" differ.
+    words = [word for word in _words(text) if word not in STOPWORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def embed(texts: List[str]) -> np.ndarray:
+    # Signed feature hashing into L2-normalized rows; stable across processes.
+    dimensions = LOCAL_INDEX_CONFIG["dimensions"]
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vectors[row, digest % dimensions] += 1.0 if digest >> 63 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _usable(answers: Dict[str, Optional[str]]) -> Dict[str, str]:
+    return {query: answer for query, answer in answers.items()
+            if isinstance(answer, str) and answer.strip() and not answer.startswith("Error:")}
+
+
+class VectorIndex:
+    # Past search answers keyed by the embedding of their query. Fixed capacity;
+    # once full the oldest entries are overwritten.
+
+    def __init__(self, capacity: int):
+        self.lock = threading.Lock()
+        self.vectors = np.zeros((max(capacity, 1), LOCAL_INDEX_CONFIG["dimensions"]), dtype=np.float32)
+        self.entries: List[Tuple[str, str]] = []
+        self.keys: List[FrozenSet[str]] = []
+        self.next = 0
+
+    @classmethod
+    def from_batches(cls, batches: Iterable[Dict[str, Optional[str]]]) -> "VectorIndex":
+        answers = {}
+        for batch in batches:
+            answers.update(_usable(batch or {}))
+        index = cls(len(answers))
+        index.add(answers)
+        return index
+
+    def add(self, answers: Dict[str, Optional[str]]) -> None:
+        answers = _usable(answers)
+        if not answers:
+            return
+        vectors = embed(list(answers))
+        with self.lock:
+            for vector, entry in zip(vectors, answers.items()):
+                slot = self.next % len(self.vectors)
+                self.vectors[slot] = vector
+                if slot < len(self.entries):
+                    self.entries[slot], self.keys[slot] = entry, key_terms(entry[0])
+                else:
+                    self.entries.append(entry)
+                    self.keys.append(key_terms(entry[0]))
+                self.next += 1
+
+    def search(self, queries: List[str], min_similarity: float) -> Dict[str, str]:
+        # The best stored answer for every query similar enough to a past one
+        # and asking about the same key terms.
+        with self.lock:
+            if not self.entries or not queries:
+                return {}
+            scores = embed(queries) @ self.vectors[:len(self.entries)].T
+            answers = {}
+            for query, row in zip(queries, scores):
+                keys = key_terms(query)
+                for slot in np.flatnonzero(row >= min_similarity)[np.argsort(-row[row >= min_similarity])]:
+                    if self.keys[slot] == keys:
+                        answers[query] = self.entries[slot][1]
+                        break
+            return answers
+
+
+global_index = VectorIndex(LOCAL_INDEX_CONFIG["global_max_entries"]) \
+    if LOCAL_INDEX_CONFIG["enabled"] and LOCAL_INDEX_CONFIG["global"] else None
+
+
+def local_answers(queries: List[str], index: Optional[VectorIndex] = None) -> Dict[str, str]:
+    # Thread index first, then the global one.
+    if not LOCAL_INDEX_CONFIG["enabled"] or not queries:
+        return {}
+    started = time.perf_counter()
+    answers = {}
+    for candidate in (index, global_index):
+        if candidate is not None and (pending := [query for query in queries if query not in answers]):
+            answers.update(candidate.search(pending, LOCAL_INDEX_CONFIG["min_similarity"]))
+    LOCAL_INDEX_LATENCY.observe(time.perf_counter() - started)
+    return answers
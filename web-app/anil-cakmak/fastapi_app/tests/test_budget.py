@@ -0,0 +1,21 @@
+import asyncio
+import pytest
+from my_agent.utils.budget import remaining, with_deadline, within_budget
+
+
+async def slow(seconds: float) -> str:
+    await asyncio.sleep(seconds)
+    return "done"
+
+
+def test_within_budget_stops_at_the_deadline():
+    config = with_deadline({"configurable": {}}, 0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(within_budget(slow(1), config))
+    assert remaining(config) < 0
+
+
+def test_within_budget_without_a_deadline():
+    config = with_deadline({"configurable": {}}, 0)
+    assert "deadline" not in config["configurable"]
+    assert asyncio.run(within_budget(slow(0), config)) == "done"
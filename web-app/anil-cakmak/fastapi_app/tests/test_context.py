@@ -0,0 +1,29 @@
+import pytest
+from my_agent.utils import context
+from my_agent.utils.context import build_context
+
+
+@pytest.mark.parametrize("batches,expected", [
+    (None, "No search results available."),
+    ([], "No search results available."),
+    ([None, {}], "No search results available."),
+    # Errors, empty and missing answers are dropped.
+    ([{"flights": "Error: timeout", "hotels": "  ", "trains": None}], "No search results available."),
+    ([{"flights": "Error: timeout", "hotels": "Hotel A costs 80 EUR."}], "- hotels: Hotel A costs 80 EUR."),
+    # Sentences already seen in another answer are dropped, up to case and stopwords.
+    ([{"hotels": "Hotel A costs 80 EUR. It is central."}, {"hotels again": "hotel a costs 80 eur! Breakfast included."}],
+     "- hotels: Hotel A costs 80 EUR. It is central.\n- hotels again: Breakfast included."),
+    ([{"hotels": "Hotel A costs 80 EUR."}, {"hotels again": "Hotel A costs 80 EUR."}], "- hotels: Hotel A costs 80 EUR."),
+])
+def test_build_context_filters_snippets(batches, expected):
+    # With no reference terms the snippets keep their order.
+    assert build_context("unbudgeted", batches, "") == expected
+
+
+def test_build_context_keeps_the_most_relevant_snippets_within_budget(monkeypatch):
+    monkeypatch.setitem(context.CONTEXT_CONFIG, "test", 20)
+    batches = [{"museums": "The Louvre opens at 9 and closes at 18 every day except Tuesday.",
+                "hotels": "Hotel Rivoli near the Louvre costs 120 EUR per night."}]
+    assert build_context("test", batches, "cheap hotel Paris") == \
+        "- hotels: Hotel Rivoli near the Louvre costs 120 EUR per night."
+    assert build_context("unbudgeted", batches, "cheap hotel Paris").splitlines()[0].startswith("- hotels:")
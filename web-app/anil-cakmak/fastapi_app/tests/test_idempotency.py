@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pytest
+from my_agent.utils import idempotency
+from my_agent.utils.idempotency import SharedRun, _claim, idempotent_events, request_key
+from my_agent.utils.kvstore import SqliteTTLStore
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    store = SqliteTTLStore(str(tmp_path / "idempotency.sqlite"), "idempotency")
+    monkeypatch.setattr(idempotency, "_store", store)
+    monkeypatch.setitem(idempotency.IDEMPOTENCY_CONFIG, "enabled", True)
+    return store
+
+
+def event(name: str, **data):
+    return {"event": name, "data": data}
+
+
+class Runs:
+    # A start callable counting its runs; each run waits for release, then
+    # yields a token and, unless failing, the final event.
+
+    def __init__(self, fail: bool = False):
+        self.count = 0
+        self.fail = fail
+        self.release = asyncio.Event()
+
+    async def __call__(self, is_disconnected):
+        self.count += 1
+        yield event("token", text="hi")
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("run failed")
+        yield event("final", text="hi")
+
+
+async def collect(events):
+    return [item async for item in events]
+
+
+def test_derived_keys_change_with_the_turn():
+    first, _ = request_key("thread", "yes", None, "checkpoint-1")
+    assert request_key("thread", "yes", None, "checkpoint-1")[0] == first
+    assert request_key("thread", "yes", None, "checkpoint-2")[0] != first
+    assert request_key("thread", "no", None, "checkpoint-1")[0] != first
+    # A client key does not depend on the turn.
+    assert request_key("thread", "yes", "k", "checkpoint-1") == request_key("thread", "yes", "k", "checkpoint-2")
+
+
+def test_claim_is_taken_once(store):
+    assert _claim("key") is None
+    assert _claim("key") == {"status": "running"}
+    store.set("key", json.dumps({"status": "done", "events": []}).encode(), 60)
+    assert _claim("key") == {"status": "done", "events": []}
+
+
+def test_follow_replays_buffered_events_to_late_clients():
+    async def run():
+        shared = SharedRun()
+        await shared.publish(event("token", text="a"))
+        late = asyncio.create_task(collect(shared.follow(None)))
+        await asyncio.sleep(0)
+        await shared.publish(event("final", text="a"))
+        await shared.finish()
+        return await late, shared.clients
+
+    events, clients = asyncio.run(run())
+    assert [item["event"] for item in events] == ["token", "final"]
+    assert clients == []
+
+
+def test_duplicates_attach_to_the_running_request_then_replay():
+    async def run():
+        runs = Runs()
+        first = asyncio.create_task(collect(idempotent_events("key", 60, runs)))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(collect(idempotent_events("key", 60, runs)))
+        await asyncio.sleep(0.05)
+        runs.release.set()
+        results = [await first, await second]
+        results.append(await collect(idempotent_events("key", 60, runs)))
+        return runs.count, results
+
+    count, results = asyncio.run(run())
+    assert count == 1
+    for events in results:
+        assert [item["event"] for item in events] == ["token", "final"]
+
+
+def test_failed_runs_release_the_key():
+    async def run():
+        runs = Runs(fail=True)
+        runs.release.set()
+        failed = await collect(idempotent_events("key", 60, runs))
+        runs.fail = False
+        events = await collect(idempotent_events("key", 60, runs))
+        return runs.count, failed, events
+
+    count, failed, events = asyncio.run(run())
+    assert count == 2
+    assert failed[-1] == event("error", message="Error: run failed")
+    assert events[-1]["event"] == "final"
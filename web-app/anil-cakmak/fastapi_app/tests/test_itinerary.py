@@ -0,0 +1,109 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from my_agent.utils import itinerary
+from my_agent.utils.itinerary import affected_days, merge_days, parse_refine, plan_segments, render_days, split_days
+from my_agent.utils.nodes import refine_target
+from my_agent.utils.query_templates import ParsedPlan
+
+ITINERARY = """Here is your trip!
+
+**Day 1: Tokyo**
+Check in at Hotel Sakura, dinner in Shinjuku.
+
+Days 2-3: Tokyo
+Senso-ji and Shibuya.
+
+### Day 4 to 5 - Kyoto
+Fushimi Inari, stay at Ryokan Gion.
+Day 4 evening: tea ceremony.
+
+Day 6: Kyoto
+Fly home."""
+
+JAPAN = {"Japan": {"Tokyo": ["Senso-ji"], "Kyoto": ["Gion"]}}
+
+
+@pytest.mark.parametrize("mode,destinations,duration,expected", [
+    ("auto", JAPAN, "10 days", [(1, 5), (6, 10)]),
+    ("auto", JAPAN, "2 weeks", [(1, 7), (8, 14)]),
+    ("auto", JAPAN, "4 nights", None),
+    ("auto", JAPAN, "6 days", None),
+    ("auto", {"Japan": {"Tokyo": ["Senso-ji"]}}, "10 days", None),
+    ("on", JAPAN, "3 days", [(1, 2), (3, 3)]),
+    ("on", JAPAN, "1 day", None),
+    ("on", JAPAN, None, None),
+    ("off", JAPAN, "10 days", None),
+])
+def test_plan_segments(monkeypatch, mode, destinations, duration, expected):
+    monkeypatch.setitem(itinerary.ITINERARY_CONFIG, "map_reduce", mode)
+    segments = plan_segments(ParsedPlan("Berlin", destinations, "April 2026", duration))
+    assert expected == (None if segments is None else [(s.first_day, s.last_day) for s in segments])
+
+
+def labels(blocks):
+    return [(block["label"], block["first"], block["last"]) for block in blocks]
+
+
+def test_split_days():
+    blocks = split_days(ITINERARY)
+    assert labels(blocks) == [(None, 0, 0), ("Day 1", 1, 1), ("Days 2-3", 2, 3), ("Days 4-5", 4, 5), ("Day 6", 6, 6)]
+    assert blocks[0]["text"] == "Here is your trip!"
+    assert blocks[2]["text"] == "Days 2-3: Tokyo\nSenso-ji and Shibuya."
+    assert render_days(blocks) == ITINERARY
+
+
+@pytest.mark.parametrize("text", ["", "Sure, where would you like to go?", "Today we look at 3 days in Rome."])
+def test_split_days_without_headings(text):
+    assert split_days(text) == []
+
+
+@pytest.mark.parametrize("request_text,expected", [
+    ("Change the hotel on day 1", ["Day 1"]),
+    ("Something else on Day 3 please", ["Days 2-3"]),
+    ("Swap day 1 and day 6", ["Day 1", "Day 6"]),
+    ("No tea ceremony on day 4", ["Days 4-5"]),
+    ("Replace Ryokan Gion with a cheaper hotel", ["Days 4-5"]),
+    ("Skip Shibuya", ["Days 2-3"]),
+    ("Make it cheaper", [None, "Day 1", "Days 2-3", "Days 4-5", "Day 6"]),
+    ("Change day 9", [None, "Day 1", "Days 2-3", "Days 4-5", "Day 6"]),
+])
+def test_affected_days(request_text, expected):
+    blocks = split_days(ITINERARY)
+    assert [blocks[i]["label"] for i in affected_days(blocks, request_text)] == expected
+
+
+def test_merge_days():
+    blocks = split_days("Day 1: A\n\nDay 2: B\n\nDay 3: C")
+    patch = split_days("Day 2: B2\n\nDay 4: D")
+    assert [block["text"] for block in merge_days(blocks, patch)] == ["Day 1: A", "Day 2: B2", "Day 3: C", "Day 4: D"]
+
+
+@pytest.mark.parametrize("task,expected", [
+    ("Refine:\nTraveler's Request: cheaper hotel on day 2\nItinerary: Day 1: A\nDay 2: B",
+     ("cheaper hotel on day 2", "Day 1: A\nDay 2: B")),
+    ("Refine:\nTraveler's Request: cheaper hotel\nItinerary: CURRENT", ("cheaper hotel", "CURRENT")),
+    ("Refine:\ntraveler's request: one more\nmuseum\n  itinerary : current", ("one more\nmuseum", "current")),
+    ("Refine:\nTraveler's Request: cheaper hotel", ("cheaper hotel", "")),
+    ("Refine: make it cheaper", ("Refine: make it cheaper", "")),
+])
+def test_parse_refine(task, expected):
+    assert parse_refine(task) == expected
+
+
+REPLY = "Day 1: Tokyo, Hotel Y\n\nDay 2: Kyoto"
+MESSAGES = [HumanMessage(content="plan it"), AIMessage(content=REPLY),
+            HumanMessage(content="cheaper hotel on day 1"), AIMessage(content="I am researching your request...")]
+
+
+@pytest.mark.parametrize("task,stored,expected", [
+    # CURRENT uses the stored itinerary, else the reply the traveler answered to.
+    ("Itinerary: CURRENT", split_days("Day 1: Osaka\n\nDay 2: Nara"), ["Day 1: Osaka"]),
+    ("Itinerary: CURRENT", [], ["Day 1: Tokyo, Hotel Y"]),
+    ("Itinerary: Day 1: Rome\nDay 2: Milan", split_days("Day 1: Osaka\n\nDay 2: Nara"), ["Day 1: Rome"]),
+])
+def test_refine_target(task, stored, expected):
+    state = {"task": f"Refine:\nTraveler's Request: cheaper hotel on day 1\n{task}", "itinerary": stored,
+             "messages": MESSAGES}
+    request, blocks, affected = refine_target(state)
+    assert request == "cheaper hotel on day 1"
+    assert [blocks[i]["text"] for i in affected] == expected
@@ -0,0 +1,76 @@
+import pytest
+from my_agent.utils.query_templates import (ParsedPlan, _parse_value, _tokens, accommodation_queries, parse_plan,
+                                            transport_queries)
+
+JAPAN = {"Japan": {"Tokyo": ["Senso-ji", "Shibuya"], "Kyoto": ["Gion"]}}
+
+PLANS = [
+    ("""Plan:
+Departure Location: Berlin
+Destinations: {Japan: {Tokyo: [Senso-ji, Shibuya], Kyoto: [Gion]}}
+Time: April 1-10, 2026
+Duration: 10 days""", ParsedPlan("Berlin", JAPAN, "April 1-10, 2026", "10 days")),
+    ("""Plan:
+Departure Location: Berlin
+Destinations: {"Japan": {"Tokyo": ["Senso-ji", "Shibuya"], "Kyoto": ['Gion']}}
+Time: April 1-10, 2026""", ParsedPlan("Berlin", JAPAN, "April 1-10, 2026", None)),
+    ("""Plan:
+**Departure Location:** Berlin
+**Destinations:** {Japan: {Tokyo: [Senso-ji, Shibuya], Kyoto: [Gion]}}
+**Time:** April 1-10, 2026
+**Duration:** 10 days""", ParsedPlan("Berlin", JAPAN, "April 1-10, 2026", "10 days")),
+    ("""Plan:
+- Departure Location: Berlin
+- Destinations: {Japan: {Tokyo: [Senso-ji, Shibuya], Kyoto: [Gion]}}
+- Time: April 1-10, 2026""", ParsedPlan("Berlin", JAPAN, "April 1-10, 2026", None)),
+    # Missing fields, broken or empty destinations: the LLM writes the queries instead.
+    ("Plan:\nDestinations: {Japan: {Tokyo: []}}\nTime: April", None),
+    ("Plan:\nDeparture Location: Berlin\nDestinations: {Japan: {Tokyo: [Senso-ji}}\nTime: April", None),
+    ("Plan:\nDeparture Location: Berlin\nDestinations: {Japan: {}}\nTime: April", None),
+    ("Plan:\nDeparture Location: Berlin\nDestinations: [Tokyo, Kyoto]\nTime: April", None),
+]
+
+
+@pytest.mark.parametrize("text,expected", PLANS)
+def test_parse_plan(text, expected):
+    assert parse_plan(text) == expected
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("{a: {b: [c, d]}}", {"a": {"b": ["c", "d"]}}),
+    ("{\"a\": ['b c', \"d\"]}", {"a": ["b c", "d"]}),
+    ("{a: [], b: {}}", {"a": [], "b": {}}),
+    ("[x, y,]", ["x", "y"]),
+    ("New York", "New York"),
+])
+def test_parse_value(text, expected):
+    assert _parse_value(_tokens(text), 0)[0] == expected
+
+
+@pytest.mark.parametrize("text,error", [
+    ("{a b}", ValueError),
+    ("{a: }", ValueError),
+    ("{a: [b", IndexError),
+])
+def test_parse_value_errors(text, error):
+    with pytest.raises(error):
+        _parse_value(_tokens(text), 0)
+
+
+def test_transport_queries():
+    plan = ParsedPlan("Berlin", {"Japan": {"Tokyo": [], "Kyoto": []}, "Korea": {"Seoul": []}}, "April 2026")
+    assert transport_queries(plan) == [
+        "cheapest flights from Berlin to Tokyo April 2026",
+        "train or bus tickets from Tokyo to Kyoto April 2026",
+        "cheapest flights from Kyoto to Seoul April 2026",
+        "cheapest flights from Seoul to Berlin April 2026",
+    ]
+
+
+def test_accommodation_queries():
+    plan = ParsedPlan("Berlin", {"Japan": {"Tokyo": ["A", "B", "C", "D"], "Kyoto": []}}, "April 2026")
+    assert accommodation_queries(plan) == [
+        "best value hotels in Tokyo, Japan April 2026",
+        "best area to stay in Tokyo near A, B, C",
+        "best value hotels in Kyoto, Japan April 2026",
+    ]
@@ -0,0 +1,89 @@
+import asyncio
+import httpx
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_openai import ChatOpenAI
+from my_agent.utils import models
+from my_agent.utils.resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, resilient_call
+
+
+def open_breaker(name: str) -> CircuitBreaker:
+    # Open, with the reset timeout already passed: the next call is the trial.
+    breaker = CircuitBreaker(name, failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    return breaker
+
+
+def http_error(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.test")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status_code, request=request))
+
+
+async def succeed() -> str:
+    return "ok"
+
+
+def test_cancelled_trial_releases_the_breaker():
+    breaker = open_breaker("test-cancelled")
+
+    async def run() -> None:
+        task = asyncio.create_task(resilient_call(lambda: asyncio.sleep(10), "test", LatencyTracker(), False, breaker))
+        await asyncio.sleep(0)
+        assert breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not breaker.trial_in_flight
+        assert await resilient_call(succeed, "test", LatencyTracker(), False, breaker) == "ok"
+
+    asyncio.run(run())
+    assert breaker.opened_at is None
+
+
+def test_non_retryable_trial_closes_the_breaker():
+    breaker = open_breaker("test-non-retryable")
+
+    async def bad_request() -> None:
+        raise http_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(resilient_call(bad_request, "test", LatencyTracker(), False, breaker))
+    assert not breaker.trial_in_flight
+    assert breaker.opened_at is None
+
+
+def test_retryable_trial_reopens_the_breaker():
+    breaker = open_breaker("test-retryable")
+    breaker.reset_seconds = 60
+
+    async def unavailable() -> None:
+        raise http_error(503)
+
+    breaker.opened_at -= 60
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(resilient_call(unavailable, "test", LatencyTracker(), False, breaker))
+    assert not breaker.trial_in_flight
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient_call(succeed, "test", LatencyTracker(), False, breaker))
+
+
+def test_stream_closed_during_trial_releases_the_breaker(monkeypatch):
+    model = models.GovernedChatOpenAI(model="gpt-test-stream", api_key="test")
+    breaker = models._breakers["openai:gpt-test-stream"] = open_breaker("test-stream")
+
+    async def chunks(self, *args, **kwargs):
+        for text in ("a", "b", "c"):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+
+    monkeypatch.setattr(ChatOpenAI, "_astream", chunks)
+
+    async def run() -> None:
+        stream = model._astream([HumanMessage(content="hi")])
+        await stream.__anext__()
+        assert breaker.trial_in_flight
+        await stream.aclose()
+
+    asyncio.run(run())
+    assert not breaker.trial_in_flight
+    assert breaker.enter() is True
@@ -0,0 +1,29 @@
+import pytest
+from langgraph.graph import END, START, StateGraph
+from my_agent.utils.state import AgentState, STATE_CONFIG, keep_latest
+
+
+@pytest.mark.parametrize("window,left,right,expected", [
+    (3, [], [], []),
+    (3, [], [1], [1]),
+    (3, [1, 2], [3], [1, 2, 3]),
+    (3, [1, 2, 3], [4], [2, 3, 4]),
+    (3, [1], [2, 3, 4, 5], [3, 4, 5]),
+    (1, [1, 2], [], [2]),
+])
+def test_keep_latest(window, left, right, expected):
+    assert keep_latest(window)(left, right) == expected
+
+
+def test_state_keeps_the_latest_search_batches():
+    # Each run appends one batch; the channel never holds more than the window.
+    graph = StateGraph(AgentState)
+    graph.add_node("searcher", lambda state: {"search": [{"query": str(len(state["search"]))}]})
+    graph.add_edge(START, "searcher")
+    graph.add_edge("searcher", END)
+    app = graph.compile()
+
+    state = {"search": []}
+    for _ in range(STATE_CONFIG["search_window"] + 2):
+        state = app.invoke(state)
+    assert len(state["search"]) == STATE_CONFIG["search_window"]
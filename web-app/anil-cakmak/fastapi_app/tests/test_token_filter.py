@@ -0,0 +1,35 @@
+import pytest
+from langchain_core.messages import AIMessageChunk
+from my_agent.chat import TokenFilter
+from my_agent.utils.nodes import routing_marker
+
+REPLIES = [
+    ("Sure, Rome in spring is lovely.", None),
+    ("Plan:\nDestination: Rome", "Plan:"),
+    ("Great, I have everything I need.\n\nPlan:\nDestination: Rome", "Plan:"),
+    ("  Refine:\nTraveler's Request: cheaper hotel", "Refine:"),
+    ("Your Plan: is ready when you are.", None),
+    ("Planning a trip? Tell me where to.", None),
+]
+
+
+def streamed(text: str, size: int) -> str:
+    # The text the filter lets through when the reply arrives in chunks of size characters.
+    token_filter = TokenFilter()
+    out = []
+    for start in range(0, len(text), size):
+        out += token_filter.feed(AIMessageChunk(content=text[start:start + size], id="reply"), "user_guide")
+    return "".join(out + token_filter.flush())
+
+
+@pytest.mark.parametrize("reply,marker", REPLIES)
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_filter_streams_exactly_what_is_not_routed(reply, marker, size):
+    assert routing_marker(reply) == marker
+    expected = reply if marker is None else reply[:reply.index(marker)].rstrip(" ")
+    assert streamed(reply, size) == expected
+
+
+def test_other_nodes_are_not_held_back():
+    token_filter = TokenFilter()
+    assert token_filter.feed(AIMessageChunk(content="Pla", id="day"), "itinerary_planner") == ["Pla"]
@@ -0,0 +1,48 @@
+import pytest
+from my_agent.utils.vector_index import LOCAL_INDEX_CONFIG, VectorIndex
+
+NEAR_MISSES = [
+    ("cheapest flights from New York to Tokyo April 1-10, 2026",
+     "cheapest flights from New York to Osaka April 1-10, 2026"),
+    ("is the Ghibli museum open on Mondays in April 2026", "is the Ghibli museum open on Tuesdays in April 2026"),
+    ("cheapest flights from Paris to Rome March 2025", "cheapest flights from Rome to Paris March 2025"),
+    ("best value hotels in Rome, Italy March 2025", "best value hotels in Rome, Italy June 2025"),
+    ("train tickets from Kyoto to Osaka April 3 2026", "train tickets from Kyoto to Osaka April 4 2026"),
+    ("best value hotels in Kyoto, Japan April 2026", "cheapest flights to Kyoto, Japan April 2026"),
+]
+
+MATCHES = [
+    ("cheapest flights from Paris to Rome March 2025", "Cheapest flights Paris to Rome, March 2025"),
+    ("best value hotels in Kyoto, Japan April 2026", "Best value hotels Kyoto Japan - April 2026"),
+    ("Senso-ji Tokyo opening hours and ticket prices", "senso ji tokyo opening hours ticket prices"),
+]
+
+
+def lookup(stored: str, query: str) -> dict:
+    index = VectorIndex(4)
+    index.add({stored: "stored answer"})
+    return index.search([query], LOCAL_INDEX_CONFIG["min_similarity"])
+
+
+@pytest.mark.parametrize("stored, query", NEAR_MISSES)
+def test_near_misses_go_to_web_search(stored, query):
+    assert lookup(stored, query) == {}
+    assert lookup(query, stored) == {}
+
+
+@pytest.mark.parametrize("stored, query", MATCHES)
+def test_rewordings_are_served_locally(stored, query):
+    assert lookup(stored, query) == {query: "stored answer"}
+
+
+def test_errors_and_empty_answers_are_not_indexed():
+    index = VectorIndex.from_batches([{"a query": "Error: timeout", "another query": "", "kept query": "answer"}])
+    assert [query for query, _ in index.entries] == ["kept query"]
+
+
+def test_full_index_overwrites_the_oldest_entry():
+    index = VectorIndex(2)
+    index.add({"hotels in Rome": "1", "hotels in Paris": "2"})
+    index.add({"hotels in Lisbon": "3"})
+    assert sorted(answer for _, answer in index.entries) == ["2", "3"]
+    assert index.search(["hotels in Rome"], LOCAL_INDEX_CONFIG["min_similarity"]) == {}
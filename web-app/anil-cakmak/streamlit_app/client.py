@@ -1,14 +1,24 @@
+import json
 import streamlit as st
 import requests
 import uuid
 
 
-def fetch_streamed_response(api_url, payload):
-    with requests.post(api_url, json=payload, stream=True) as response:
+def fetch_events(api_url, payload, idempotency_key):
+    # Reruns and retries of the same turn reuse the key, so the API attaches
+    # them to the run already in progress instead of starting another one.
+    with requests.post(api_url, json=payload, headers={"Idempotency-Key": idempotency_key},
+                       stream=True) as response:
         response.raise_for_status()
-        for chunk in response.iter_content(chunk_size=None):
-            if chunk:
-                yield chunk.decode("utf-8")
+        fields = {}
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                if not line.startswith(":"):
+                    name, _, value = line.partition(":")
+                    fields[name] = value[1:] if value.startswith(" ") else value
+            elif "data" in fields:
+                yield fields.get("event", "message"), json.loads(fields["data"])
+                fields = {}
 
 
 def main(api_url):
@@ -33,12 +43,37 @@ def main(api_url):
             st.markdown(user_input)
 
 
-        for chunk in fetch_streamed_response(api_url, {"user_input": user_input, "thread": st.session_state["thread_id"]}):
-            with st.chat_message("assistant"):
-                st.markdown(chunk)
-            st.session_state.messages.append({"role": "assistant", "content": chunk})
+        with st.chat_message("assistant"):
+            status = st.status("Working on it...")
+            placeholder = st.empty()
+            response = ""
+            failed = False
+
+            thread = st.session_state["thread_id"]
+            turn_key = f"{thread}-{len(st.session_state.messages)}"
+            for event, data in fetch_events(api_url, {"user_input": user_input, "thread": thread}, turn_key):
+                if event == "node_started":
+                    status.update(label=f"{data['node'].replace('_', ' ').capitalize()}...")
+                elif event == "node_finished":
+                    status.write(f"{data['node']} finished in {data['duration_ms'] / 1000:.1f}s")
+                elif event == "search_batch_done":
+                    status.write(f"{data['node']} ran {data['queries']} searches")
+                elif event == "itinerary_patch":
+                    status.write(f"Updated {', '.join(day['label'] for day in data['days'])}")
+                elif event == "degradation":
+                    status.write(f"{data['node']}: {data['kind'].replace('_', ' ')} to stay within the time budget")
+                elif event == "token":
+                    response += data["text"]
+                    placeholder.markdown(response)
+                elif event == "error":
+                    response += data["message"]
+                    placeholder.markdown(response)
+                    failed = True
+
+            status.update(label="Failed" if failed else "Done", state="error" if failed else "complete", expanded=False)
+        st.session_state.messages.append({"role": "assistant", "content": response})
 
 
 if __name__ == "__main__":
-    API_URL = "http://fastapi:8000/agent"
+    API_URL = "http://fastapi:8000/agent/events"
     main(API_URL)